@@ -23,9 +23,67 @@
 # KSU 201025 Added support for str() and len().  I should have known about these.
 #            But I didn't.  Also updated test cases and provided an example of
 #            how to iterate a BinaryTree.
-
+# Queue is now backed by a collections.deque, so dequeue() is O(1)
+#            instead of the O(n) list.pop(0); the API is unchanged.  Added
+#            benchmarkQueue() ('python datastructures.py bench').
+# Added RingBuffer, a fixed capacity double ended buffer, with optional
+#            typed array (or NumPy) storage for numeric data.
+# Added BlockingQueue and BlockingStack, bounded thread-safe variants for
+#            producer/consumer threads, with blocking put/get, timeouts,
+#            getMany() and close().  They can hold None.
+# Added AsyncQueue and AsyncStack, their asyncio counterparts, with
+#            async iteration and batch draining.  Benchmarked against
+#            asyncio.Queue by benchmarkAsyncQueue().
+# BinaryTree(balanced=True) is an AVL tree, rebalanced on insert and
+#            delete.  Implemented delete() (both modes, min/max kept
+#            correct) and clear().  Added benchmarkBinaryTree().
+# Traversals are now lazy generators with explicit stacks (no recursion
+#            limit on degenerate trees), yielding (key, data); see walk().
+#            Added TRAVERSALS.LEVELORDER, and iteration over BinaryTree.
+# Added BinaryTree.fromSorted() and fromIterable(), which build a
+#            perfectly balanced tree in O(n) (after sorting), and
+#            implemented balance() in the same way.
+# TreeNodes now count the nodes in their subtree, which gives
+#            BinaryTree rank() and select() in O(log n); also added
+#            range(), floor(), ceiling(), successor() and predecessor().
+# Node and TreeNode use __slots__ (no per node __dict__), which saves
+#            about 30% of a tree's memory.  Added BinaryTree.lookup(), 'in' and [] to
+#            get data without copying a node.  Added benchmarkMemory().
+# Added BTree, a B-tree stored in a file of fixed size pages (read via
+#            mmap, with an LRU page cache), with bulk loading and
+#            journaled, crash safe flush().  Added benchmarkBTree().
+# Added dump() and load() to Stack, Queue and BinaryTree: streamed
+#            binary snapshots, trees in pre-order so a load relinks the
+#            same shape without comparisons.  Added benchmarkSnapshot().
+
+import io
+import os
+import gc
+import sys
+import mmap
+import zlib
+import pickle
+import struct
+import bisect
+import shutil
+import tempfile
 import random
+import tracemalloc
+import asyncio
+import threading
+from queue import Empty, Full
+from array import array
 from enum import Enum
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from itertools import islice
+from timer import Timer
+
+# NumPy is optional; it can back a RingBuffer (see RingBuffer dtype).
+try:
+   import numpy as np
+except ImportError:
+   np = None
 
 # Constants
 APP_NAME    = "DataStructures"
@@ -37,10 +95,68 @@ APP_BLURB   = "Library containing simple data structures for Python"
 APP_SYNTAX  = "'import gamzia.datastructures' or example: 'from gamzia.datastructures import Stack'"
 
 class TRAVERSALS(Enum):
-   INORDER   = 1
-   REVERSE   = 2
-   PREORDER  = 3
-   POSTORDER = 4
+   INORDER    = 1
+   REVERSE    = 2
+   PREORDER   = 3
+   POSTORDER  = 4
+   LEVELORDER = 5
+
+#*************************************************************************
+
+# Binary snapshots, written by dump() and read by load() on Stack, Queue
+# and BinaryTree.  A snapshot is a header (see _SNAPSHOT: magic, the
+# kind of structure, flags and the item count), then the items in
+# chunks of _SNAPSHOT_CHUNK, each a pickled list.  One pickler writes
+# the whole stream, so an object shared by several items (a Datum, say)
+# is stored once and shared again after loading, as with pickle.dump();
+# but only one chunk is ever built in memory, either way.  As with any
+# pickle, only load snapshots from a trusted source.
+_SNAPSHOT = struct.Struct("<8scBQ")
+_SNAPSHOT_MAGIC = b"GZSNAP01"
+_SNAPSHOT_CHUNK = 4096
+
+# Writes a snapshot to file object f, from an iterable of chunks (lists)
+def _dumpSnapshot(f, kind, flags, count, chunks):
+   f.write(_SNAPSHOT.pack(_SNAPSHOT_MAGIC, kind, flags, count))
+   pickler=pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+   for chunk in chunks:
+      pickler.dump(chunk)
+
+# Splits an iterable into lists of up to 'size' items
+def _chunked(iterable, size=_SNAPSHOT_CHUNK):
+   iterator=iter(iterable)
+   while (True):
+      chunk=list(islice(iterator, size))
+      if (not chunk):
+         return
+      yield (chunk)
+
+# Reads a snapshot header from file object f, checking it is of 'kind'.
+# Returns (flags, count, chunks): chunks lazily yields the lists
+# written, 'width' entries per item, until 'count' items were read.
+# Raises ValueError for anything that isn't such a snapshot, or ends
+# early.
+def _loadSnapshot(f, kind, width=1):
+   header=f.read(_SNAPSHOT.size)
+   if (len(header) < _SNAPSHOT.size):
+      raise ValueError("Not a snapshot: too short")
+   magic, found, flags, count = _SNAPSHOT.unpack(header)
+   if (magic!=_SNAPSHOT_MAGIC):
+      raise ValueError("Not a snapshot: bad magic number")
+   if (found!=kind):
+      raise ValueError(f"Snapshot is of kind {found!r}, not {kind!r}")
+
+   def chunks():
+      unpickler=pickle.Unpickler(f)
+      remaining=count*width
+      while (remaining > 0):
+         try:
+            chunk=unpickler.load()
+         except (EOFError, pickle.UnpicklingError):
+            raise ValueError(f"Snapshot truncated or corrupt, {remaining//width} items short") from None
+         remaining-=len(chunk)
+         yield (chunk)
+   return ((flags, count, chunks()))
 
 #*************************************************************************
 
@@ -136,6 +252,22 @@ class Stack:
          s.push(data)
       return(s)
 
+   # Writes a binary snapshot of the stack, bottom to top, to the (binary)
+   # file object f; see _dumpSnapshot().
+   def dump(self, f):
+      _dumpSnapshot(f, b"S", 0, len(self.__stack), _chunked(self.__stack))
+
+   # Reads a stack written by dump() from file object f, leaving f just
+   # past it.  Raises ValueError if f doesn't hold one.
+   @classmethod
+   def load(cls, f):
+      s=cls()
+      flags, count, chunks = _loadSnapshot(f, b"S")
+      with _bulkAllocation():
+         for chunk in chunks:
+            s.__stack.extend(chunk)
+      return (s)
+
    # Creates a string representation of stack, bottom up by default.
    # Set topdown=True for a visualization of stack from top downwards.
    def toString(self, topdown=False):
@@ -149,10 +281,11 @@ class Stack:
 
 #*************************************************************************
 
-# Classic FIFO structure
+# Classic FIFO structure.  Backed by a deque, so enqueue and dequeue
+# are both O(1).
 class Queue:
    def __init__(self):
-      self.__queue=[]
+      self.__queue=deque()
       self.isdebug=False
 
       # Some convenience methods for users of other languages
@@ -198,8 +331,7 @@ class Queue:
    
    # Empties queue.
    def clear(self):
-      del(self.__queue)
-      self.__queue=[]
+      self.__queue.clear()
 
    # Places item at tail of queue.
    def enqueue(self, obj):
@@ -213,7 +345,7 @@ class Queue:
          if (self.isdebug):
             print(f"   Dequeued first item '{self.__queue[0]}' from queue." \
                   f"  Size: {self.size()}")
-         return(self.__queue.pop(0))
+         return(self.__queue.popleft())
       else:
          return(None)
 
@@ -238,10 +370,25 @@ class Queue:
    # Makes a deep copy of itself
    def copy(self):
       q=Queue()
-      for data in self.__queue:
-         q.enqueue(data)
+      q.__queue.extend(self.__queue)
       return(q)
 
+   # Writes a binary snapshot of the queue, head to tail, to the (binary)
+   # file object f; see _dumpSnapshot().
+   def dump(self, f):
+      _dumpSnapshot(f, b"Q", 0, len(self.__queue), _chunked(self.__queue))
+
+   # Reads a queue written by dump() from file object f, leaving f just
+   # past it.  Raises ValueError if f doesn't hold one.
+   @classmethod
+   def load(cls, f):
+      q=cls()
+      flags, count, chunks = _loadSnapshot(f, b"Q")
+      with _bulkAllocation():
+         for chunk in chunks:
+            q.__queue.extend(chunk)
+      return (q)
+
    # Creates a string representation of queue, front to back.
    def toString(self):
       s=""
@@ -251,9 +398,661 @@ class Queue:
 
 #*************************************************************************
 
+# Sequences RingBuffer.extend() can slice without copying them first.
+# Others (a deque, a dict, a generator) are listed before slicing.
+_SLICEABLE = (list, tuple, range, array) + ((np.ndarray,) if np is not None else ())
+
+# Fixed capacity circular buffer, with O(1) push and pop at both ends.
+# Storage is allocated once, up front, so memory never grows.  When full,
+# a push either fails (returns False), or with overwrite=True, discards
+# the item at the opposite end (ie pushBack() drops the oldest item),
+# which makes a sliding window of the most recent items.
+# Numeric data can be stored compactly: pass an array module 'typecode'
+# (ie "d" for doubles) or, with NumPy installed, a NumPy 'dtype'.
+class RingBuffer:
+   def __init__(self, capacity, overwrite=False, typecode=None, dtype=None):
+      if (capacity<1):
+         raise ValueError("RingBuffer capacity must be at least 1")
+      if (typecode is not None and dtype is not None):
+         raise ValueError("Use either typecode or dtype, not both")
+      if (dtype is not None and np is None):
+         raise ImportError("A NumPy backed RingBuffer requires NumPy")
+
+      self.__capacity=capacity
+      self.__typecode=typecode
+      self.__dtype=dtype
+      self.__buffer=self.__allocate(capacity)
+      self.__head=0
+      self.__size=0
+      self.overwrite=overwrite
+      self.isdebug=False
+
+      # Some convenience methods for users of other languages
+      self.append=self.pushBack
+      self.push=self.pushBack
+      self.enqueue=self.pushBack
+      self.push_back=self.pushBack
+      self.appendleft=self.pushFront
+      self.push_front=self.pushFront
+      self.pop=self.popBack
+      self.pop_back=self.popBack
+      self.popleft=self.popFront
+      self.dequeue=self.popFront
+      self.pop_front=self.popFront
+      self.first=self.peekFront
+      self.front=self.peekFront
+      self.peek=self.peekFront
+      self.last=self.peekBack
+      self.back=self.peekBack
+      self.reset=self.clear
+      self.delete=self.clear
+      self.length=self.size
+
+   # Iter() + next() implements iterative protocol.
+   # __iter__ must return an iterative object
+   def __iter__(self):
+      return self
+
+   # Next must return the next item (data) in the sequence,
+   # or raise the StopIteration exception.
+   # Like a Queue, iterating is destructive (front to back); use
+   # toList() for a non destructive view.
+   def __next__(self):
+      if (self.__size==0):
+         raise StopIteration
+      return self.popFront()
+
+   # Produced size of structure
+   def __len__(self):
+      return self.size()
+
+   # Allows conversion of object to string by Python natives
+   def __str__(self):
+      return self.toString()
+
+   # Storage for 'capacity' items
+   def __allocate(self, capacity):
+      if (self.__dtype is not None):
+         return (np.zeros(capacity, dtype=self.__dtype))
+      if (self.__typecode is not None):
+         return (array(self.__typecode, [0]) * capacity)
+      return ([None] * capacity)
+
+   # Copies 'count' items out, starting at buffer index 'start' (which
+   # may wrap), as the backing's own type (list, array or ndarray).
+   def __read(self, start, count):
+      first=min(count, self.__capacity-start)
+      if (self.__dtype is not None):
+         return (np.concatenate((self.__buffer[start:start+first], self.__buffer[:count-first])))
+      return (self.__buffer[start:start+first] + self.__buffer[:count-first])
+
+   # Writes 'values' at buffer index 'start', wrapping as needed
+   def __write(self, start, values):
+      count=len(values)
+      first=min(count, self.__capacity-start)
+      if (self.__typecode is not None):
+         values=array(self.__typecode, values)
+      self.__buffer[start:start+first]=values[:first]
+      self.__buffer[:count-first]=values[first:]
+
+   # Releases references held by (object) slots that were popped
+   def __forget(self, start, count):
+      if (self.__typecode is None and self.__dtype is None):
+         self.__write(start, [None]*count)
+
+   # Empties buffer; the storage is kept.
+   def clear(self):
+      self.__forget(self.__head, self.__size)
+      self.__head=0
+      self.__size=0
+
+   # Places item at the back.  Returns False if the buffer is full and
+   # overwrite is off; otherwise True (dropping the front item if full).
+   def pushBack(self, obj):
+      if (self.__size==self.__capacity):
+         if (not self.overwrite):
+            return (False)
+         self.popFront()
+      self.__buffer[(self.__head+self.__size) % self.__capacity]=obj
+      self.__size+=1
+      if (self.isdebug):
+         print(f"   Pushed '{obj}' onto back of buffer. Size:  {self.__size}")
+      return (True)
+
+   # Places item at the front.  Returns False if the buffer is full and
+   # overwrite is off; otherwise True (dropping the back item if full).
+   def pushFront(self, obj):
+      if (self.__size==self.__capacity):
+         if (not self.overwrite):
+            return (False)
+         self.popBack()
+      self.__head=(self.__head-1) % self.__capacity
+      self.__buffer[self.__head]=obj
+      self.__size+=1
+      if (self.isdebug):
+         print(f"   Pushed '{obj}' onto front of buffer. Size:  {self.__size}")
+      return (True)
+
+   # Removes front item and returns it, or None if empty.
+   def popFront(self):
+      if (self.__size==0):
+         return (None)
+      obj=self.__buffer[self.__head]
+      self.__forget(self.__head, 1)
+      self.__head=(self.__head+1) % self.__capacity
+      self.__size-=1
+      return (obj)
+
+   # Removes back item and returns it, or None if empty.
+   def popBack(self):
+      if (self.__size==0):
+         return (None)
+      index=(self.__head+self.__size-1) % self.__capacity
+      obj=self.__buffer[index]
+      self.__forget(index, 1)
+      self.__size-=1
+      return (obj)
+
+   # Reveals front item without discarding it.
+   def peekFront(self):
+      if (self.__size==0):
+         return (None)
+      return (self.__buffer[self.__head])
+
+   # Reveals back item without discarding it.
+   def peekBack(self):
+      if (self.__size==0):
+         return (None)
+      return (self.__buffer[(self.__head+self.__size-1) % self.__capacity])
+
+   # Pushes every item onto the back, in bulk (a couple of slice copies,
+   # not one push per item).  Without overwrite, stops when full; with
+   # overwrite, the oldest items are dropped to make room.  Returns the
+   # number of items stored.  Sequences known to slice (see
+   # _SLICEABLE) are copied as they are; anything else is listed first.
+   def extend(self, items):
+      if (not isinstance(items, _SLICEABLE)):
+         items=list(items)
+      count=len(items)
+      free=self.__capacity-self.__size
+
+      if (not self.overwrite):
+         count=min(count, free)
+         items=items[:count]
+      elif (count > self.__capacity):
+         items=items[count-self.__capacity:]
+         count=self.__capacity
+
+      # Make room by dropping from the front
+      if (count > free):
+         self.__forget(self.__head, count-free)
+         self.__head=(self.__head+count-free) % self.__capacity
+         self.__size-=count-free
+
+      self.__write((self.__head+self.__size) % self.__capacity, items)
+      self.__size+=count
+      return (count)
+
+   # Removes up to n items (all, by default) from the front, and returns
+   # them in order; a list, or an array/ndarray for typed buffers.
+   def drain(self, n=None):
+      count=self.__size if n is None else max(0, min(n, self.__size))
+      items=self.__read(self.__head, count)
+      self.__forget(self.__head, count)
+      self.__head=(self.__head+count) % self.__capacity
+      self.__size-=count
+      return (items)
+
+   # Non destructive copy of the contents, front to back, as a list
+   def toList(self):
+      items=self.__read(self.__head, self.__size)
+      if (isinstance(items, list)):
+         return (items)
+      return (items.tolist())
+
+   # Returns number of items held
+   def size(self):
+      return (self.__size)
+
+   # Returns the fixed number of items the buffer can hold
+   def capacity(self):
+      return (self.__capacity)
+
+   # True when no more items fit (without overwriting)
+   def isFull(self):
+      return (self.__size==self.__capacity)
+
+   # True when the buffer holds nothing
+   def isEmpty(self):
+      return (self.__size==0)
+
+   # Makes a deep copy of itself
+   def copy(self):
+      rb=RingBuffer(self.__capacity, self.overwrite, self.__typecode, self.__dtype)
+      rb.extend(self.__read(self.__head, self.__size))
+      return (rb)
+
+   # Creates a string representation of buffer, front to back.
+   def toString(self):
+      s=""
+      for value in self.__read(self.__head, self.__size):
+         s+=f"{value}\n"
+      return(s)
+
+#*************************************************************************
+
+# Raised by put() on a closed BlockingQueue/BlockingStack, and by get()
+# once a closed one is empty.
+class Closed(Exception):
+   pass
+
+# Thread-safe FIFO for producer/consumer threads.  A positive 'maxsize'
+# bounds it: put() then blocks while it is full (backpressure), just as
+# get() blocks while it is empty.  Both accept a timeout, and raise
+# queue.Full / queue.Empty when it runs out (or at once, if block=False).
+# close() stops further puts, and wakes every waiting thread; consumers
+# still get what is left, then Closed.  Since emptiness is signalled by
+# exceptions, not a None sentinel, None is an ordinary item.
+class BlockingQueue:
+   def __init__(self, maxsize=0):
+      self.maxsize=maxsize
+      self._items=deque()
+      self.__closed=False
+      self.__lock=threading.Lock()
+      self.__notEmpty=threading.Condition(self.__lock)
+      self.__notFull=threading.Condition(self.__lock)
+
+      # Some convenience methods for users of other languages
+      self.put_many=self.putMany
+      self.get_many=self.getMany
+      self.shutdown=self.close
+      self.add=self.put
+      self.append=self.put
+      self.enqueue=self.put
+      self.push=self.put
+      self.pop=self.get
+      self.take=self.get
+      self.dequeue=self.get
+      self.reset=self.clear
+      self.length=self.size
+
+   # Iterates until the queue is closed and empty; blocks while waiting
+   # for items.  Like Queue, iterating consumes the items.
+   def __iter__(self):
+      return self
+
+   def __next__(self):
+      try:
+         return self.get()
+      except Closed:
+         raise StopIteration
+
+   # Produced size of structure
+   def __len__(self):
+      return self.size()
+
+   # Removes the next item; the lock is held.  BlockingStack overrides
+   # this to take from the other end.
+   def _take(self):
+      return (self._items.popleft())
+
+   # Waits on 'condition' until ready() or the deadline, raising
+   # 'timeoutError' if it passes.  The lock is held.
+   def __wait(self, condition, ready, block, timeout, timeoutError):
+      if (ready()):
+         return
+      if (not block):
+         raise timeoutError
+      if (not condition.wait_for(ready, timeout)):
+         raise timeoutError
+
+   # Adds an item, waiting for room if the queue is bounded and full.
+   # Raises queue.Full on timeout, and Closed if the queue is closed.
+   def put(self, obj, block=True, timeout=None):
+      with self.__lock:
+         self.__wait(self.__notFull, lambda: self.__closed or self.maxsize<=0 or len(self._items) < self.maxsize,
+                     block, timeout, Full)
+         if (self.__closed):
+            raise Closed("put() on a closed queue")
+         self._items.append(obj)
+         self.__notEmpty.notify()
+
+   # Adds every item, under one lock per batch of free room rather than
+   # one per item.  Blocks (with the same timeout, raising queue.Full)
+   # while full.  Returns the number of items added.  Items go in as
+   # room frees up, so a Full (or Closed) raised part way through carries
+   # the number already added as its 'added' attribute; retry with
+   # items[e.added:].
+   def putMany(self, items, block=True, timeout=None):
+      items=list(items)
+      added=0
+      try:
+         while (added < len(items)):
+            with self.__lock:
+               self.__wait(self.__notFull, lambda: self.__closed or self.maxsize<=0 or len(self._items) < self.maxsize,
+                           block, timeout, Full)
+               if (self.__closed):
+                  raise Closed("put() on a closed queue")
+               room=len(items)-added if self.maxsize<=0 else self.maxsize-len(self._items)
+               batch=items[added:added+room]
+               self._items.extend(batch)
+               added+=len(batch)
+               self.__notEmpty.notify(len(batch))
+      except (Full, Closed) as e:
+         e.added=added
+         raise
+      return (added)
+
+   # Removes and returns the next item, waiting for one if empty.
+   # Raises queue.Empty on timeout, and Closed once closed and empty.
+   def get(self, block=True, timeout=None):
+      with self.__lock:
+         self.__wait(self.__notEmpty, lambda: self.__closed or len(self._items) > 0,
+                     block, timeout, Empty)
+         if (len(self._items)==0):
+            raise Closed("get() on a closed, empty queue")
+         obj=self._take()
+         self.__notFull.notify()
+         return (obj)
+
+   # Removes and returns up to n items as a list, under one lock.  Waits
+   # (like get()) only for the first item; never for the rest.
+   def getMany(self, n, block=True, timeout=None):
+      with self.__lock:
+         self.__wait(self.__notEmpty, lambda: self.__closed or len(self._items) > 0,
+                     block, timeout, Empty)
+         if (len(self._items)==0):
+            raise Closed("get() on a closed, empty queue")
+         items=[self._take() for i in range(min(n, len(self._items)))]
+         self.__notFull.notify(len(items))
+         return (items)
+
+   # Stops further puts and wakes every waiting thread.  Items already
+   # queued can still be taken.  Closing twice is harmless.
+   def close(self):
+      with self.__lock:
+         self.__closed=True
+         self.__notEmpty.notify_all()
+         self.__notFull.notify_all()
+
+   # True once close() has been called
+   def isClosed(self):
+      return (self.__closed)
+
+   # Discards every item (waking blocked producers)
+   def clear(self):
+      with self.__lock:
+         self._items.clear()
+         self.__notFull.notify_all()
+
+   # Returns number of items held; only a snapshot, with other threads
+   def size(self):
+      return (len(self._items))
+
+   # Snapshot tests; see size()
+   def isEmpty(self):
+      return (len(self._items)==0)
+
+   def isFull(self):
+      return (self.maxsize>0 and len(self._items)>=self.maxsize)
+
+# Thread-safe LIFO; a BlockingQueue which takes the newest item first.
+class BlockingStack(BlockingQueue):
+   def _take(self):
+      return (self._items.pop())
+
+#*************************************************************************
+
+# asyncio FIFO; the coroutine counterpart of BlockingQueue, for use
+# within one event loop (it is not thread-safe).  'await put()' waits
+# while a bounded queue is full, 'await get()' while it is empty; both
+# accept a timeout, raising queue.Full / queue.Empty when it runs out.
+# The *Nowait() methods never wait.  After close(), puts raise Closed,
+# and gets return what is left, then raise Closed.  'async for' ends
+# cleanly at that point, so None is an ordinary item.
+# Waiting coroutines park on futures, woken one at a time, as in
+# asyncio.Queue.
+class AsyncQueue:
+   def __init__(self, maxsize=0):
+      self.maxsize=maxsize
+      self._items=deque()
+      self.__getters=deque()
+      self.__putters=deque()
+      self.__closed=False
+
+      # Some convenience methods for users of other languages
+      self.put_nowait=self.putNowait
+      self.get_nowait=self.getNowait
+      self.put_many=self.putMany
+      self.get_many=self.getMany
+      self.shutdown=self.close
+      self.add=self.put
+      self.append=self.put
+      self.enqueue=self.put
+      self.push=self.put
+      self.pop=self.get
+      self.take=self.get
+      self.dequeue=self.get
+      self.first=self.peek
+      self.front=self.peek
+      self.look=self.peek
+      self.reset=self.clear
+      self.length=self.size
+
+   # 'async for' support; ends once the queue is closed and empty.
+   # Iterating consumes the items.
+   def __aiter__(self):
+      return self
+
+   async def __anext__(self):
+      try:
+         return await self.get()
+      except Closed:
+         raise StopAsyncIteration
+
+   # Produced size of structure
+   def __len__(self):
+      return self.size()
+
+   # Removes the next item.  AsyncStack overrides these two to work
+   # at the other end.
+   def _take(self):
+      return (self._items.popleft())
+
+   def _next(self):
+      return (self._items[0])
+
+   def __hasRoom(self):
+      return (self.__closed or self.maxsize<=0 or len(self._items) < self.maxsize)
+
+   def __hasItems(self):
+      return (self.__closed or len(self._items) > 0)
+
+   # Wakes the first of 'waiters' still waiting
+   def __wakeNext(self, waiters):
+      while (waiters):
+         waiter=waiters.popleft()
+         if (not waiter.done()):
+            waiter.set_result(None)
+            return
+
+   # Parks on a future in 'waiters' until ready(), raising 'timeoutError'
+   # if the timeout passes first.  If cancelled after being woken, the
+   # wake up is handed to the next waiter, so it isn't lost.  Callers
+   # check ready() first, so the common case never awaits anything.
+   async def __wait(self, waiters, ready, timeout, timeoutError):
+      loop=asyncio.get_running_loop()
+      deadline=None if timeout is None else loop.time()+timeout
+
+      while (not ready()):
+         waiter=loop.create_future()
+         waiters.append(waiter)
+         try:
+            if (deadline is None):
+               await waiter
+            else:
+               await asyncio.wait_for(waiter, max(0, deadline-loop.time()))
+         except BaseException as e:
+            waiter.cancel()
+            try:
+               waiters.remove(waiter)
+            except ValueError:
+               pass
+            if (ready()):
+               self.__wakeNext(waiters)
+            if (isinstance(e, asyncio.TimeoutError)):
+               raise timeoutError from None
+            raise
+
+   # Adds an item without waiting; raises queue.Full or Closed.
+   def putNowait(self, obj):
+      if (self.__closed):
+         raise Closed("put() on a closed queue")
+      if (not self.__hasRoom()):
+         raise Full
+      self._items.append(obj)
+      if (self.__getters):
+         self.__wakeNext(self.__getters)
+
+   # Adds an item, waiting for room while the queue is full.
+   async def put(self, obj, timeout=None):
+      if (not self.__hasRoom()):
+         await self.__wait(self.__putters, self.__hasRoom, timeout, Full)
+      self.putNowait(obj)
+
+   # Adds every item, waiting for room as needed.  Returns the number
+   # of items added.  As with BlockingQueue.putMany(), a Full (or Closed)
+   # raised part way through has the number already added as 'added'.
+   async def putMany(self, items, timeout=None):
+      added=0
+      try:
+         for obj in items:
+            if (not self.__hasRoom()):
+               await self.__wait(self.__putters, self.__hasRoom, timeout, Full)
+            self.putNowait(obj)
+            added+=1
+      except (Full, Closed) as e:
+         e.added=added
+         raise
+      return (added)
+
+   # Removes and returns the next item without waiting; raises
+   # queue.Empty, or Closed once closed and empty.
+   def getNowait(self):
+      if (len(self._items)==0):
+         if (self.__closed):
+            raise Closed("get() on a closed, empty queue")
+         raise Empty
+      obj=self._take()
+      if (self.__putters):
+         self.__wakeNext(self.__putters)
+      return (obj)
+
+   # Removes and returns the next item, waiting while empty.
+   async def get(self, timeout=None):
+      if (len(self._items)==0):
+         await self.__wait(self.__getters, self.__hasItems, timeout, Empty)
+      return (self.getNowait())
+
+   # Removes and returns up to n items as a list.  Waits (like get())
+   # only for the first item; never for the rest.
+   async def getMany(self, n, timeout=None):
+      if (len(self._items)==0):
+         await self.__wait(self.__getters, self.__hasItems, timeout, Empty)
+      items=[self.getNowait()]
+      while (len(items) < n and len(self._items) > 0):
+         items.append(self.getNowait())
+      return (items)
+
+   # Removes and returns up to n items (all, by default) that are ready
+   # now, as a list; never waits, and never raises.
+   def drain(self, n=None):
+      count=len(self._items) if n is None else min(n, len(self._items))
+      return ([self.getNowait() for i in range(count)])
+
+   # Reveals the next item without removing it, or None if empty.
+   def peek(self):
+      if (len(self._items)==0):
+         return (None)
+      return (self._next())
+
+   # Stops further puts and wakes every waiting coroutine.  Items already
+   # queued can still be taken.  Closing twice is harmless.
+   def close(self):
+      self.__closed=True
+      for waiter in list(self.__getters)+list(self.__putters):
+         if (not waiter.done()):
+            waiter.set_result(None)
+      self.__getters.clear()
+      self.__putters.clear()
+
+   # True once close() has been called
+   def isClosed(self):
+      return (self.__closed)
+
+   # Discards every item (waking waiting producers)
+   def clear(self):
+      self._items.clear()
+      for waiter in self.__putters:
+         if (not waiter.done()):
+            waiter.set_result(None)
+      self.__putters.clear()
+
+   # Returns number of items held
+   def size(self):
+      return (len(self._items))
+
+   def isEmpty(self):
+      return (len(self._items)==0)
+
+   def isFull(self):
+      return (self.maxsize>0 and len(self._items)>=self.maxsize)
+
+# asyncio LIFO; an AsyncQueue which takes the newest item first.
+class AsyncStack(AsyncQueue):
+   def __init__(self, maxsize=0):
+      super().__init__(maxsize)
+      self.top=self.peek
+      self.see=self.peek
+
+   def _take(self):
+      return (self._items.pop())
+
+   def _next(self):
+      return (self._items[-1])
+
+#*************************************************************************
+
+# Pauses the cyclic garbage collector while millions of nodes are
+# allocated at once; otherwise it rescans them over and over, which
+# more than doubles the time of a bulk load.
+@contextmanager
+def _bulkAllocation():
+   enabled=gc.isenabled()
+   gc.disable()
+   try:
+      yield
+   finally:
+      if (enabled):
+         gc.enable()
+
+# (key, data) of a bulk load item: a Node (its key and data are used),
+# a (key, data) pair, or otherwise a bare key.  NOTE: tuple keys must
+# therefore be given as (key, data) pairs.
+def _keyData(item):
+   if (isinstance(item, Node)):
+      return ((item.key, item.data))
+   if (isinstance(item, tuple) and len(item)==2):
+      return (item)
+   return ((item, None))
+
 # A node must have a comparable key (int, str, etc...) and the data
 # component is optional.  IE, if the key is the data, then data can be None.
+# Slots keep nodes compact (no per instance __dict__); descendants
+# should declare __slots__ for their own attributes too.
 class Node:
+   __slots__ = ("key", "data")
+
    def __init__(self, key, data=None):
       self.key=key
       self.data=data
@@ -263,30 +1062,44 @@ class Node:
    def copy(self):
       return(Node(self.key, self.data))
 
+# 'height' is the height of the subtree rooted here (a leaf is 1); it is
+# only maintained by balanced trees.  'size' is the number of nodes in
+# the subtree (including this one), maintained by every tree.
 class TreeNode(Node):
+   __slots__ = ("leftChild", "rightChild", "height", "size")
+
    def __init__(self, key, data=None):
       self.key=key
       self.data=data
       self.leftChild=None
       self.rightChild=None
+      self.height=1
+      self.size=1
 
    # Creates a deep copy
    def copy(self):
       treenode=TreeNode(self.key, self.data)
       treenode.leftChild=self.leftChild
       treenode.rightChild=self.rightChild
+      treenode.height=self.height
+      treenode.size=self.size
       return(treenode)
 
 # Binary tree construct.  Requries orderable key (int, str, etc...)
 # as it is based on ordering data by comparison.
-# Note: To iterate a BinaryTree, first traverse it with a chosen
-# order,  and then iterate the returned list and search eack key.
+# Iterating a BinaryTree yields (key, data) pairs in sorted key order;
+# walk() yields them in any of the TRAVERSALS orders.
+# With balanced=True, the tree is an AVL tree: after every insert and
+# delete, subtrees whose heights differ by more than one are rotated
+# back into balance, so the tree's height stays O(log n) whatever the
+# order of insertion (sorted keys would otherwise build a linked list).
 class BinaryTree:
-   def __init__(self):
+   def __init__(self, balanced=False):
       self.__root=None
       self.__size=0
       self.__min=None
       self.__max=None
+      self.__balanced=balanced
       self.isdebug=False
 
       # Convenience methods
@@ -298,7 +1111,8 @@ class BinaryTree:
       self.remove=self.delete
       self.get=self.search
       self.length=self.size
-      #self.reset=self.clear
+      self.reset=self.clear
+      self.rebalance=self.balance
 
    # Produced size of structure
    def __len__(self):
@@ -308,67 +1122,181 @@ class BinaryTree:
    def __str__(self):
       return self.toString()
    
-   #def clear(self):
-      # TODO: Implememt delete algorithm as explained in Algorithm Book (Correl et al.)
+   # Empties the tree.  Dropping the root is enough; Python frees the
+   # nodes once nothing else refers to them.
+   def clear(self):
+      self.__root=None
+      self.__size=0
+      self.__min=None
+      self.__max=None
 
-   # Walks the tree in ascending sorted order
-   def __traverseInOrder(self, node, bucket):
-      if not node:
-         return
-      # Recurse left side of tree
-      self.__traverseInOrder(node.leftChild, bucket)
-      # Done left, take self as temp root
-      bucket.append(node.key)
-      # Append right side
-      self.__traverseInOrder(node.rightChild, bucket)
-
-   # Walks the tree in descending sorted order
-   def __traverseReverse(self, node, bucket):
-      if not node:
-         return
-      # Recurse left side of tree
-      self.__traverseReverse(node.rightChild, bucket)
-      # Done left, take self as temp root
-      bucket.append(node.key)
-      # Append right side
-      self.__traverseReverse(node.leftChild, bucket)
+   # True if the tree rebalances itself (AVL)
+   def isBalanced(self):
+      return (self.__balanced)
+
+   # Height of a subtree; 0 for an empty one
+   def __height(self, node):
+      return (node.height if node else 0)
+
+   # Node count of a subtree; 0 for an empty one
+   def __count(self, node):
+      return (node.size if node else 0)
+
+   # Recomputes a node's height and size from its children
+   def __updateNode(self, node):
+      node.height=1+max(self.__height(node.leftChild), self.__height(node.rightChild))
+      node.size=1+self.__count(node.leftChild)+self.__count(node.rightChild)
+
+   #     node          left
+   #    /    \        /    \
+   #  left    c  -->  a    node
+   #  /  \                 /  \
+   # a    b               b    c
+   def __rotateRight(self, node):
+      left=node.leftChild
+      node.leftChild=left.rightChild
+      left.rightChild=node
+      self.__updateNode(node)
+      self.__updateNode(left)
+      return (left)
+
+   # Mirror image of __rotateRight()
+   def __rotateLeft(self, node):
+      right=node.rightChild
+      node.rightChild=right.leftChild
+      right.leftChild=node
+      self.__updateNode(node)
+      self.__updateNode(right)
+      return (right)
+
+   # Restores the AVL property at node, whose subtrees are balanced, but
+   # may differ in height by two.  Returns the subtree's new root.
+   def __rebalance(self, node):
+      self.__updateNode(node)
+      balance=self.__height(node.leftChild)-self.__height(node.rightChild)
+      if (balance > 1):
+         # Left heavy; a left-right case needs its child rotated first
+         if (self.__height(node.leftChild.leftChild) < self.__height(node.leftChild.rightChild)):
+            node.leftChild=self.__rotateLeft(node.leftChild)
+         return (self.__rotateRight(node))
+      if (balance < -1):
+         if (self.__height(node.rightChild.rightChild) < self.__height(node.rightChild.leftChild)):
+            node.rightChild=self.__rotateRight(node.rightChild)
+         return (self.__rotateLeft(node))
+      return (node)
+
+   # Rebalances, bottom up, the nodes on 'path' (from the root down to
+   # where the tree changed).  Stops early once a subtree's height is
+   # unchanged, as nothing above it can have changed either.  (Sizes on
+   # the path must already be updated.)
+   def __rebalancePath(self, path):
+      for i in range(len(path)-1, -1, -1):
+         node=path[i]
+         height=node.height
+         subtree=self.__rebalance(node)
+         if (i==0):
+            self.__root=subtree
+         elif (path[i-1].leftChild is node):
+            path[i-1].leftChild=subtree
+         else:
+            path[i-1].rightChild=subtree
+         if (subtree is node and subtree.height==height):
+            break
+
+   # Iterates (key, data) pairs in ascending key order.  Unlike Stack
+   # and Queue, iterating a tree is not destructive.
+   def __iter__(self):
+      return (self.__walkInOrder())
+
+   # Walks the tree in ascending sorted order.  The explicit stack holds
+   # the path of nodes whose left side is still being walked.
+   def __walkInOrder(self):
+      stack=[]
+      node=self.__root
+      while (stack or node):
+         # Go as far left as possible
+         while (node):
+            stack.append(node)
+            node=node.leftChild
+         node=stack.pop()
+         yield (node.key, node.data)
+         # Then walk its right side
+         node=node.rightChild
+
+   # Walks the tree in descending sorted order; mirror of in order
+   def __walkReverse(self):
+      stack=[]
+      node=self.__root
+      while (stack or node):
+         while (node):
+            stack.append(node)
+            node=node.rightChild
+         node=stack.pop()
+         yield (node.key, node.data)
+         node=node.leftChild
 
    # Pre Order walks the tree as it is represented
-   def __traversePreOrder(self, node, bucket):
-      if (not node):
-         return
-      # Start with current node key
-      bucket.append(node.key)
-      # Recurse left
-      self.__traversePreOrder(node.leftChild, bucket)
-      # Recurse right
-      self.__traversePreOrder(node.rightChild, bucket)
+   def __walkPreOrder(self):
+      stack=[self.__root] if self.__root else []
+      while (stack):
+         node=stack.pop()
+         yield (node.key, node.data)
+         # Right is pushed first, so left is walked first
+         if (node.rightChild):
+            stack.append(node.rightChild)
+         if (node.leftChild):
+            stack.append(node.leftChild)
 
    # Never really knew what post order represented. May be good for
    # a deletion order of the tree, otherwise who knows. RTFM dude.
-   def __traversePostOrder(self, node, bucket):
-      if (not node):
-         return
-      # Recurse left
-      self.__traversePostOrder(node.leftChild, bucket)
-      # Recurse right
-      self.__traversePostOrder(node.rightChild, bucket)
-      # Now use current node
-      bucket.append(node.key)
+   # A node is yielded once its right side is done, which is when the
+   # last node yielded was its right child (or it has none).
+   def __walkPostOrder(self):
+      stack=[]
+      node=self.__root
+      last=None
+      while (stack or node):
+         if (node):
+            stack.append(node)
+            node=node.leftChild
+         else:
+            top=stack[-1]
+            if (top.rightChild and last is not top.rightChild):
+               node=top.rightChild
+            else:
+               last=stack.pop()
+               yield (last.key, last.data)
+
+   # Level order walks the tree breadth first, top down, left to right
+   def __walkLevelOrder(self):
+      queue=deque([self.__root] if self.__root else [])
+      while (queue):
+         node=queue.popleft()
+         yield (node.key, node.data)
+         if (node.leftChild):
+            queue.append(node.leftChild)
+         if (node.rightChild):
+            queue.append(node.rightChild)
+
+   # Lazily walks the tree in the requested order, yielding (key, data)
+   # pairs.  Memory used is bounded by the tree's height (or, in level
+   # order, its widest level), and no recursion is involved.  The tree
+   # must not be changed during the walk.
+   def walk(self, traversalOrder=TRAVERSALS.INORDER):
+      if (traversalOrder==TRAVERSALS.REVERSE):
+         return (self.__walkReverse())
+      elif (traversalOrder==TRAVERSALS.PREORDER):
+         return (self.__walkPreOrder())
+      elif (traversalOrder==TRAVERSALS.POSTORDER):
+         return (self.__walkPostOrder())
+      elif (traversalOrder==TRAVERSALS.LEVELORDER):
+         return (self.__walkLevelOrder())
+      return (self.__walkInOrder())
 
    # Traverses the tree by requested order.  Returns a list of
-   # all values, in order defined by the TRAVERSALS enumeration.
+   # all keys, in order defined by the TRAVERSALS enumeration.
    def traverse(self, traversalOrder=TRAVERSALS.INORDER):
-      bucket=[]
-      if (traversalOrder==TRAVERSALS.INORDER):
-         self.__traverseInOrder(self.__root, bucket)
-      elif (traversalOrder==TRAVERSALS.REVERSE):
-         self.__traverseReverse(self.__root, bucket)
-      elif (traversalOrder==TRAVERSALS.PREORDER):
-         self.__traversePreOrder(self.__root, bucket)
-      elif (traversalOrder==TRAVERSALS.POSTORDER):
-         self.__traversePostOrder(self.__root, bucket)
-      return(bucket)
+      return ([key for key, data in self.walk(traversalOrder)])
 
    # Converts all node keys to string and lists them.
    # The optional parameter represents the order of rendering.
@@ -394,9 +1322,12 @@ class BinaryTree:
       else:
          current = self.__root
          parent=None
+         # Nodes visited, for rebalancing
+         path=[]
 
          while True:
             parent=current
+            path.append(parent)
 
             # Start with duplicate test (update case)
             if (key == parent.key):
@@ -413,7 +1344,7 @@ class BinaryTree:
                   # only need to check min
                   if (key < self.__min):
                      self.__min=key
-                  return
+                  break
             else:
                # Check to the right (>)
                current = current.rightChild
@@ -423,7 +1354,13 @@ class BinaryTree:
                   # only need to chek max
                   if (key > self.__max):
                      self.__max=key
-                  return
+                  break
+
+         # Every node on the path gained a descendant
+         for node in path:
+            node.size+=1
+         if (self.__balanced):
+            self.__rebalancePath(path)
       return
 
    # Allows for quick insertion of a key when there is no associated data.
@@ -431,55 +1368,58 @@ class BinaryTree:
       treenode = TreeNode(key)
       return (self.insert(treenode))
 
-   # Searchs a tree for value, returns True if found, False otherwise.
-   def exists(self, key):
+   # Returns the node with key, or None
+   def __find(self, key):
       current = self.__root
 
-      if (not current):
-         return False
-
-      while (not current.key==key):
-         if (current):
-            if self.isdebug:
-               print(f"At tree node with key: {current.key}")
+      while (current and not current.key==key):
+         if self.isdebug:
+            print(f"At tree node with key: {current.key}")
 
-            if (current.key > key):
-               # Go left
-               current=current.leftChild
+         if (current.key > key):
+            # Go left
+            current=current.leftChild
 
-            else:
-               # Go right
-               current=current.rightChild
+         else:
+            # Go right
+            current=current.rightChild
 
-            if (not current):
-               return False
+      return (current)
 
-      return True
+   # Searchs a tree for value, returns True if found, False otherwise.
+   def exists(self, key):
+      return (self.__find(key) is not None)
 
    # Searchs a tree for value, returns the node if found, None otherwise.
+   # The node is a copy, so changing it can't corrupt the tree; use
+   # lookup() to get just the data, without allocating a node.
    def search(self, key):
-      current = self.__root
-
-      if (not current):
+      if (not self.__root):
          return False
+      current=self.__find(key)
+      if (not current):
+         return None
+      return(current.copy())
 
-      while (not current.key==key):
-         if (current):
-            if self.isdebug:
-               print(f"At tree node with key: {current.key}")
-
-            if (current.key > key):
-               # Go left
-               current=current.leftChild
-
-            else:
-               # Go right
-               current=current.rightChild
+   # Returns the data stored with key (not a copy), or 'default' if the
+   # key isn't in the tree.
+   def lookup(self, key, default=None):
+      current=self.__find(key)
+      if (not current):
+         return (default)
+      return (current.data)
 
-            if (not current):
-               return None
+   # Supports 'key in tree'
+   def __contains__(self, key):
+      return (self.__find(key) is not None)
 
-      return(current.copy())
+   # Supports tree[key], which returns the data (not a copy), or raises
+   # KeyError if the key isn't in the tree.
+   def __getitem__(self, key):
+      current=self.__find(key)
+      if (not current):
+         raise KeyError(key)
+      return (current.data)
 
    # Calculates the height of left side, and right side, and returns
    # a tuple of (left height, right height). Note that the height
@@ -510,31 +1450,326 @@ class BinaryTree:
 
 
    # Balances the tree.  Does this by doing an inorder (sorted)
-   # traversal, then retrieving each node from the middle outwards,
-   # and building a new tree.  Balancing is memory intensive.
+   # traversal, then relinking the existing nodes from the middle
+   # outwards (see __link()).  No nodes are allocated; O(n) time, with
+   # a list of n node references as the only extra memory.
    def balance(self):
-      # TODO: NOT IMPLEMENTED
-      return(None)
-
-      # Get keys
-      keys=self.traverse(TRAVERSAL.TRAVERSE_INORDER)
-      # Get their node data
-      nodes={}
-      for key in keys:
-         nodes[key]=self.search(key)
-      # Split, and move outward
-      mid=len(keys)//2
-      steps=mid
-      bst=BinaryTree()
-      for i in range(1, steps):
-         bst.insert(keys[mid-i], nodes[keys[mid-i]])
-
-   # Deletes a node from the BST based on key.
-   # Automatically rebalances tree.
+      nodes=[]
+      stack=[]
+      node=self.__root
+      while (stack or node):
+         while (node):
+            stack.append(node)
+            node=node.leftChild
+         node=stack.pop()
+         nodes.append(node)
+         node=node.rightChild
+      self.__root=self.__link(nodes, 0, len(nodes))
+
+   # Links nodes[lo:hi] (sorted by key) into a perfectly balanced
+   # subtree, the middle node as its root, and returns that root.
+   # Recursion is only as deep as the resulting tree, ie log2(n).
+   def __link(self, nodes, lo, hi):
+      if (lo>=hi):
+         return (None)
+      mid=(lo+hi)//2
+      node=nodes[mid]
+      node.leftChild=self.__link(nodes, lo, mid)
+      node.rightChild=self.__link(nodes, mid+1, hi)
+      # The height of a perfectly balanced tree of m nodes
+      node.height=(hi-lo).bit_length()
+      node.size=hi-lo
+      return (node)
+
+   # Node for a bulk load item; see _keyData()
+   @staticmethod
+   def __loadNode(item):
+      key, data = _keyData(item)
+      return (TreeNode(key, data))
+
+   # Builds a perfectly balanced tree, in O(n), from items already in
+   # ascending key order; see _keyData() for what an item can be.  A
+   # repeated key updates the data, as insert() would.  Raises
+   # ValueError if the keys are out of order.  With balanced=True the
+   # tree stays balanced (AVL) through later inserts and deletes.
+   @classmethod
+   def fromSorted(cls, items, balanced=False):
+      with _bulkAllocation():
+         return (cls.__fromNodes(map(BinaryTree.__loadNode, items), balanced))
+
+   # Like fromSorted(), but sorts the items first, in O(n log n); for
+   # repeated keys, the last item wins.
+   @classmethod
+   def fromIterable(cls, items, balanced=False):
+      with _bulkAllocation():
+         nodes=[BinaryTree.__loadNode(item) for item in items]
+         # Stable, so equal keys keep their order and the last one wins
+         nodes.sort(key=lambda node: node.key)
+         return (cls.__fromNodes(nodes, balanced))
+
+   # Snake case aliases, for the constructors
+   from_sorted=fromSorted
+   from_iterable=fromIterable
+
+   # Builds a tree from new TreeNodes in ascending key order
+   @classmethod
+   def __fromNodes(cls, treenodes, balanced):
+      nodes=[]
+      for node in treenodes:
+         if (nodes and not nodes[-1].key < node.key):
+            if (nodes[-1].key==node.key):
+               nodes[-1].data=node.data
+               continue
+            raise ValueError(f"fromSorted() keys out of order: {node.key} after {nodes[-1].key}")
+         nodes.append(node)
+
+      tree=cls(balanced=balanced)
+      tree.__root=tree.__link(nodes, 0, len(nodes))
+      tree.__size=len(nodes)
+      if (nodes):
+         tree.__min=nodes[0].key
+         tree.__max=nodes[-1].key
+      return (tree)
+
+   # Writes a binary snapshot of the tree to the (binary) file object f;
+   # see _dumpSnapshot().  Nodes are written in pre-order, each as its
+   # key, data and shape (bit 0 set if it has a left child, bit 1 if it
+   # has a right one), which is all load() needs to link the same tree
+   # back together, with no key comparisons.
+   def dump(self, f):
+      _dumpSnapshot(f, b"T", 1 if self.__balanced else 0, self.__size, self.__dumpChunks())
+
+   # Pre-order chunks of (key, data, shape) triples, flattened
+   def __dumpChunks(self):
+      chunk=[]
+      stack=[self.__root] if self.__root else []
+      while (stack):
+         node=stack.pop()
+         left, right = node.leftChild, node.rightChild
+         chunk.append(node.key)
+         chunk.append(node.data)
+         chunk.append((1 if left else 0) | (2 if right else 0))
+         if (right):
+            stack.append(right)
+         if (left):
+            stack.append(left)
+         if (len(chunk) >= 3*_SNAPSHOT_CHUNK):
+            yield (chunk)
+            chunk=[]
+      if (chunk):
+         yield (chunk)
+
+   # Reads a tree written by dump() from file object f, leaving f just
+   # past it, balanced (AVL) if the tree dumped was.  Raises ValueError
+   # if f doesn't hold one.
+   @classmethod
+   def load(cls, f):
+      flags, count, chunks = _loadSnapshot(f, b"T", 3)
+      tree=cls(balanced=bool(flags & 1))
+      with _bulkAllocation():
+         # Each node is linked to the first open child slot on the stack:
+         # a left slot is pushed after its node's right one, so the left
+         # subtree is filled in first, as it was written.
+         nodes=[]
+         slots=[]
+         for chunk in chunks:
+            for i in range(0, len(chunk), 3):
+               node=TreeNode(chunk[i], chunk[i+1])
+               if (slots):
+                  parent, side = slots.pop()
+                  if (side):
+                     parent.rightChild=node
+                  else:
+                     parent.leftChild=node
+               elif (nodes):
+                  raise ValueError("Snapshot tree shape is inconsistent")
+               nodes.append(node)
+               shape=chunk[i+2]
+               if (shape & 2):
+                  slots.append((node, 1))
+               if (shape & 1):
+                  slots.append((node, 0))
+         if (slots or len(nodes)!=count):
+            raise ValueError("Snapshot tree shape is inconsistent")
+
+         # Descendants follow their ancestors in pre-order, so going
+         # backwards sets every node's height and size after its children's
+         for node in reversed(nodes):
+            left, right = node.leftChild, node.rightChild
+            if (left and right):
+               node.height=1+max(left.height, right.height)
+               node.size=1+left.size+right.size
+            elif (left or right):
+               child=left or right
+               node.height=1+child.height
+               node.size=1+child.size
+
+      if (nodes):
+         tree.__root=nodes[0]
+         tree.__size=count
+         node=tree.__root
+         while (node.leftChild):
+            node=node.leftChild
+         tree.__min=node.key
+         node=tree.__root
+         while (node.rightChild):
+            node=node.rightChild
+         tree.__max=node.key
+      return (tree)
+
+   # Deletes a node from the BST based on key.  Returns True if it was
+   # found, False otherwise.  A node with two children takes the key and
+   # data of its successor (the smallest key to its right), which is
+   # then unlinked instead.  Balanced trees are rebalanced on the way back
+   # up.  Min and max are found again if the deleted key was one of them.
    def delete(self, key):
-      #self.__size-=1
-      #reset min, max -> use inorder traversal, take 1st and last elements
-      pass
+      path=[]
+      current=self.__root
+      while (current and not current.key==key):
+         path.append(current)
+         if (current.key > key):
+            current=current.leftChild
+         else:
+            current=current.rightChild
+      if (not current):
+         return (False)
+
+      if (current.leftChild and current.rightChild):
+         path.append(current)
+         successor=current.rightChild
+         while (successor.leftChild):
+            path.append(successor)
+            successor=successor.leftChild
+         current.key=successor.key
+         current.data=successor.data
+         current=successor
+
+      # current now has at most one child, which takes its place
+      child=current.leftChild if current.leftChild else current.rightChild
+      if (not path):
+         self.__root=child
+      elif (path[-1].leftChild is current):
+         path[-1].leftChild=child
+      else:
+         path[-1].rightChild=child
+      self.__size-=1
+      # Every node on the path lost a descendant
+      for node in path:
+         node.size-=1
+
+      if (self.__balanced):
+         self.__rebalancePath(path)
+
+      if (self.__size==0):
+         self.__min=self.__max=None
+      else:
+         if (key==self.__min):
+            node=self.__root
+            while (node.leftChild):
+               node=node.leftChild
+            self.__min=node.key
+         if (key==self.__max):
+            node=self.__root
+            while (node.rightChild):
+               node=node.rightChild
+            self.__max=node.key
+      return (True)
+
+   # Lazily yields (key, data) pairs with lo <= key <= hi, in ascending
+   # order.  Either bound may be None (unbounded).  Only the subtrees
+   # that can hold keys in range are visited: O(log n + k) for k keys.
+   def range(self, lo=None, hi=None):
+      stack=[]
+      node=self.__root
+      while (stack or node):
+         # Go left as far as possible, skipping subtrees below lo
+         while (node):
+            if (lo is not None and node.key < lo):
+               node=node.rightChild
+            else:
+               stack.append(node)
+               node=node.leftChild
+         if (not stack):
+            return
+         node=stack.pop()
+         if (hi is not None and node.key > hi):
+            return
+         yield (node.key, node.data)
+         node=node.rightChild
+
+   # Largest key <= key (or < key when 'strict'), or None
+   def __below(self, key, strict):
+      best=None
+      node=self.__root
+      while (node):
+         if (node.key < key or (not strict and node.key==key)):
+            best=node.key
+            node=node.rightChild
+         else:
+            node=node.leftChild
+      return (best)
+
+   # Smallest key >= key (or > key when 'strict'), or None
+   def __above(self, key, strict):
+      best=None
+      node=self.__root
+      while (node):
+         if (node.key > key or (not strict and node.key==key)):
+            best=node.key
+            node=node.leftChild
+         else:
+            node=node.rightChild
+      return (best)
+
+   # Returns the largest key <= key, or None if there is none.  The key
+   # itself need not be in the tree; likewise for the methods below.
+   def floor(self, key):
+      return (self.__below(key, False))
+
+   # Returns the smallest key >= key, or None if there is none.
+   def ceiling(self, key):
+      return (self.__above(key, False))
+
+   # Returns the smallest key > key, or None if there is none.
+   def successor(self, key):
+      return (self.__above(key, True))
+
+   # Returns the largest key < key, or None if there is none.
+   def predecessor(self, key):
+      return (self.__below(key, True))
+
+   # Returns the number of keys in the tree smaller than key; a key's
+   # position (from 0) in sorted order.  O(height), using subtree sizes.
+   def rank(self, key):
+      rank=0
+      node=self.__root
+      while (node):
+         if (key <= node.key):
+            node=node.leftChild
+         else:
+            rank+=self.__count(node.leftChild)+1
+            node=node.rightChild
+      return (rank)
+
+   # Returns the k'th smallest key (from 0), or None if k is out of
+   # range.  Negative k counts from the largest key, like list indices.
+   # O(height), using subtree sizes.
+   def select(self, k):
+      if (k<0):
+         k+=self.__size
+      if (k<0 or k>=self.__size):
+         return (None)
+      node=self.__root
+      while (node):
+         left=self.__count(node.leftChild)
+         if (k<left):
+            node=node.leftChild
+         elif (k==left):
+            return (node.key)
+         else:
+            k-=left+1
+            node=node.rightChild
+      return (None)
 
    # Returns minimum value of the tree. This is maintained during
    # inserts/deletes, therefore a traversal is not required.
@@ -551,6 +1786,568 @@ class BinaryTree:
    def size(self):
       return(self.__size)
 
+#*************************************************************************
+
+# One B-tree page, decoded.  'keys' are sorted, 'values' hold the data of
+# each key, and internal pages have len(keys)+1 'children' page numbers
+# (leaves have none).
+class _BTreePage:
+   __slots__ = ("number", "keys", "values", "children")
+
+   def __init__(self, number, keys=None, values=None, children=None):
+      self.number=number
+      self.keys=keys if keys is not None else []
+      self.values=values if values is not None else []
+      self.children=children if children is not None else []
+
+   def isLeaf(self):
+      return (not self.children)
+
+   # The page as stored: a 4 byte length, then the pickled lists
+   def encode(self):
+      data=pickle.dumps((self.keys, self.values, self.children), protocol=pickle.HIGHEST_PROTOCOL)
+      return (struct.pack("<I", len(data)) + data)
+
+   @staticmethod
+   def decode(number, buffer, offset):
+      length=struct.unpack_from("<I", buffer, offset)[0]
+      keys, values, children = pickle.loads(buffer[offset+4:offset+4+length])
+      return (_BTreePage(number, keys, values, children))
+
+   # Size of one (key, value) entry, as measured everywhere a page is
+   # filled (insert, split and bulk load), so they all agree on it
+   @staticmethod
+   def entrySize(key, value):
+      return (len(pickle.dumps((key, value), protocol=pickle.HIGHEST_PROTOCOL)))
+
+   # Largest entry a page of 'pageSize' bytes accepts, so a split always
+   # fits.  Returns the entry's size, or raises ValueError if it is over.
+   @staticmethod
+   def checkEntry(key, value, pageSize):
+      size=_BTreePage.entrySize(key, value)
+      if (size > (pageSize-4)//4):
+         raise ValueError(f"BTree entry for key {key!r} is larger than {(pageSize-4)//4} bytes")
+      return (size)
+
+# Disk backed B-tree, with the same insert/search/traverse API as
+# BinaryTree.  The tree lives in a file of fixed size pages, read through
+# mmap: page 0 is a header, every other page one node, holding as many
+# sorted (key, data) entries as fit.  Keys and data are pickled, so they
+# can be any picklable (and, for keys, orderable) objects; as with any
+# pickle, only open files from a trusted source.
+#
+# Decoded pages are kept in an LRU cache of 'cacheSize' pages.  Changes
+# stay in the cache until flush(), which commits them atomically, using
+# a rollback journal (like SQLite): the original contents of every page
+# about to be overwritten are first copied to "<path>-journal" and
+# synced, then the pages are written, and deleting the journal commits.
+# If a crash interrupts a flush, the journal is rolled back the next time
+# the file is opened, so the tree is always as of its last flush.  Once
+# more than 'cacheSize' pages are dirty, the next insert flushes.
+class BTree:
+   MAGIC = b"GZBTREE1"
+   HEADER = struct.Struct("<8sIIIQ")
+
+   def __init__(self, path, pageSize=4096, cacheSize=256):
+      self.path=path
+      self.journalPath=path+"-journal"
+      self.cacheSize=cacheSize
+      self.isdebug=False
+
+      self.__recover()
+      exists=os.path.exists(path) and os.path.getsize(path) > 0
+      self.__file=open(path, "r+b" if exists else "w+b")
+      if (exists):
+         magic, self.pageSize, self.__root, self.__pageCount, self.__size = \
+            BTree.HEADER.unpack(self.__file.read(BTree.HEADER.size))
+         if (magic!=BTree.MAGIC):
+            self.__file.close()
+            raise ValueError(f"{path} is not a BTree file")
+      else:
+         if (pageSize < 256):
+            self.__file.close()
+            raise ValueError("BTree pageSize must be at least 256 bytes")
+         self.pageSize=pageSize
+         self.__root=0
+         self.__pageCount=1
+         self.__size=0
+         self.__file.write(self.__header().ljust(pageSize, b"\0"))
+         self.__file.flush()
+         os.fsync(self.__file.fileno())
+
+      # Entries bigger than this are refused (see _BTreePage.checkEntry())
+      self.maxEntry=(self.pageSize-4)//4
+      self.__map=mmap.mmap(self.__file.fileno(), 0)
+      self.__committedPages=self.__pageCount
+      self.__cache=OrderedDict()
+      self.__dirty=dict()
+      self.__headerDirty=False
+
+      # Convenience methods
+      self.doesexist=self.exists
+      self.find=self.search
+      self.put=self.insert
+      self.push=self.insert
+      self.retrieve=self.search
+      self.get=self.search
+      self.length=self.size
+      self.commit=self.flush
+
+   # Produced size of structure
+   def __len__(self):
+      return self.size()
+
+   # Allows conversion of object to string by Python natives
+   def __str__(self):
+      return self.toString()
+
+   # Iterates (key, data) pairs in ascending key order
+   def __iter__(self):
+      return (self.walk())
+
+   # 'with BTree(path) as tree:' closes (and so flushes) the tree on exit
+   def __enter__(self):
+      return (self)
+
+   def __exit__(self, type, value, traceback):
+      self.close()
+
+   def __header(self):
+      return (BTree.HEADER.pack(BTree.MAGIC, self.pageSize, self.__root, self.__pageCount, self.__size))
+
+   # Rolls back an interrupted flush.  A journal that is incomplete (its
+   # checksum fails) was being written when the crash happened, before
+   # the tree file was touched, so it is simply discarded.
+   def __recover(self):
+      if (not os.path.exists(self.journalPath)):
+         return
+      with open(self.journalPath, "rb") as f:
+         journal=f.read()
+      if (len(journal) >= 20 and journal[:8]==BTree.MAGIC and
+          zlib.crc32(journal[:-4])==struct.unpack_from("<I", journal, len(journal)-4)[0]):
+         pageSize, count = struct.unpack_from("<II", journal, 8)
+         with open(self.path, "r+b") as f:
+            offset=16
+            for i in range(count):
+               number=struct.unpack_from("<I", journal, offset)[0]
+               f.seek(number*pageSize)
+               f.write(journal[offset+4:offset+4+pageSize])
+               offset+=4+pageSize
+            f.flush()
+            os.fsync(f.fileno())
+      os.remove(self.journalPath)
+      self.__syncDirectory()
+
+   # Makes the journal's creation (or removal) itself durable, by syncing
+   # the directory holding it.  Windows can't open (or sync) a directory.
+   def __syncDirectory(self):
+      if (os.name!="posix"):
+         return
+      fd=os.open(os.path.dirname(self.journalPath) or ".", os.O_RDONLY)
+      try:
+         os.fsync(fd)
+      finally:
+         os.close(fd)
+
+   # Returns page 'number', from the cache or the file
+   def __page(self, number):
+      page=self.__cache.get(number)
+      if (page is not None):
+         self.__cache.move_to_end(number)
+         return (page)
+      page=_BTreePage.decode(number, self.__map, number*self.pageSize)
+      self.__cache[number]=page
+      self.__evict()
+      return (page)
+
+   # Drops least recently used clean pages past 'cacheSize'.  Dirty
+   # pages stay until flushed.
+   def __evict(self):
+      if (len(self.__cache) <= self.cacheSize):
+         return
+      for number in list(self.__cache):
+         if (len(self.__cache) <= self.cacheSize):
+            break
+         if (number not in self.__dirty):
+            del self.__cache[number]
+
+   def __markDirty(self, page):
+      self.__dirty[page.number]=page
+      self.__cache[page.number]=page
+
+   def __newPage(self):
+      page=_BTreePage(self.__pageCount)
+      self.__pageCount+=1
+      self.__headerDirty=True
+      self.__markDirty(page)
+      return (page)
+
+   # Splits an overfull page in two, at the entry where the (approximate)
+   # encoded sizes balance.  Returns (median key, median value, new right
+   # page); the page keeps the left half.
+   def __split(self, page):
+      sizes=[_BTreePage.entrySize(key, value) for key, value in zip(page.keys, page.values)]
+      half=sum(sizes)/2
+      total=0
+      mid=0
+      while (mid < len(sizes)-2 and total+sizes[mid] < half):
+         total+=sizes[mid]
+         mid+=1
+      mid=max(1, mid)
+
+      right=self.__newPage()
+      right.keys=page.keys[mid+1:]
+      right.values=page.values[mid+1:]
+      key, value = page.keys[mid], page.values[mid]
+      del page.keys[mid:]
+      del page.values[mid:]
+      if (page.children):
+         right.children=page.children[mid+1:]
+         del page.children[mid+1:]
+      return ((key, value, right))
+
+   # Inserts a tnode (any Node: its key and data) into the tree.  A
+   # duplicate key updates the data.  Raises ValueError if the pickled
+   # entry is bigger than a quarter of a page.
+   def insert(self, tnode):
+      key, data = tnode.key, tnode.data
+      _BTreePage.checkEntry(key, data, self.pageSize)
+
+      if (self.__root==0):
+         page=self.__newPage()
+         page.keys.append(key)
+         page.values.append(data)
+         self.__root=page.number
+         self.__size+=1
+         return
+
+      # Descend to a leaf (or the key), remembering the way back up
+      path=[]
+      page=self.__page(self.__root)
+      while True:
+         i=bisect.bisect_left(page.keys, key)
+         if (i < len(page.keys) and page.keys[i]==key):
+            page.values[i]=data
+            break
+         if (page.isLeaf()):
+            page.keys.insert(i, key)
+            page.values.insert(i, data)
+            self.__size+=1
+            self.__headerDirty=True
+            break
+         path.append((page, i))
+         page=self.__page(page.children[i])
+      self.__markDirty(page)
+
+      # Split overfull pages (new data may be bigger too), pushing their
+      # median entries upwards
+      while (len(page.encode()) > self.pageSize):
+         median, value, right = self.__split(page)
+         if (path):
+            parent, i = path.pop()
+            parent.keys.insert(i, median)
+            parent.values.insert(i, value)
+            parent.children.insert(i+1, right.number)
+            self.__markDirty(parent)
+            page=parent
+         else:
+            root=self.__newPage()
+            root.keys=[median]
+            root.values=[value]
+            root.children=[page.number, right.number]
+            self.__root=root.number
+            break
+
+      if (len(self.__dirty) > self.cacheSize):
+         self.flush()
+
+   # Allows for quick insertion of a key when there is no associated data.
+   def insertKey(self, key):
+      return (self.insert(Node(key)))
+
+   # Returns (page, index) of key, or (None, None)
+   def __find(self, key):
+      if (self.__root==0):
+         return ((None, None))
+      page=self.__page(self.__root)
+      while True:
+         i=bisect.bisect_left(page.keys, key)
+         if (i < len(page.keys) and page.keys[i]==key):
+            return ((page, i))
+         if (page.isLeaf()):
+            return ((None, None))
+         page=self.__page(page.children[i])
+
+   # Searchs the tree for key, returns True if found, False otherwise.
+   def exists(self, key):
+      return (self.__find(key)[0] is not None)
+
+   # Searchs the tree for key; returns a Node with its key and data if
+   # found, None otherwise.
+   def search(self, key):
+      page, i = self.__find(key)
+      if (page is None):
+         return (None)
+      return (Node(page.keys[i], page.values[i]))
+
+   # Returns the data stored with key, or 'default' if not found.
+   def lookup(self, key, default=None):
+      page, i = self.__find(key)
+      if (page is None):
+         return (default)
+      return (page.values[i])
+
+   # Supports 'key in tree'
+   def __contains__(self, key):
+      return (self.exists(key))
+
+   # Supports tree[key]; raises KeyError if not found
+   def __getitem__(self, key):
+      page, i = self.__find(key)
+      if (page is None):
+         raise KeyError(key)
+      return (page.values[i])
+
+   # Lazily walks the tree, yielding (key, data) pairs in ascending key
+   # order, or descending for TRAVERSALS.REVERSE.  Other orders describe
+   # binary trees, and raise ValueError (straight away, not on the first
+   # next()).  Pages are read as needed, so the walk holds only one path
+   # of pages at a time.
+   def walk(self, traversalOrder=TRAVERSALS.INORDER):
+      if (traversalOrder not in (TRAVERSALS.INORDER, TRAVERSALS.REVERSE)):
+         raise ValueError(f"BTree supports INORDER and REVERSE traversals, not {traversalOrder.name}")
+      return (self.__walk(traversalOrder==TRAVERSALS.REVERSE))
+
+   # The generator behind walk()
+   def __walk(self, reverse):
+      if (self.__root==0):
+         return
+
+      # Each entry is (page, index of the next entry to yield, counted
+      # from the end when reversed)
+      stack=[(self.__page(self.__root), 0)]
+      self.__descend(stack, reverse)
+      while (stack):
+         page, i = stack.pop()
+         if (i >= len(page.keys)):
+            continue
+         j = len(page.keys)-1-i if reverse else i
+         stack.append((page, i+1))
+         yield (page.keys[j], page.values[j])
+         if (not page.isLeaf()):
+            child = page.children[j] if reverse else page.children[j+1]
+            stack.append((self.__page(child), 0))
+            self.__descend(stack, reverse)
+
+   # Extends the stack down the first (or last) children to a leaf
+   def __descend(self, stack, reverse):
+      page=stack[-1][0]
+      while (not page.isLeaf()):
+         page=self.__page(page.children[-1] if reverse else page.children[0])
+         stack.append((page, 0))
+
+   # Returns a list of all keys, in ascending (or REVERSE) order
+   def traverse(self, traversalOrder=TRAVERSALS.INORDER):
+      return ([key for key, data in self.walk(traversalOrder)])
+
+   # Converts all keys to string and lists them
+   def toString(self, traversal=TRAVERSALS.INORDER):
+      return (", ".join(str(key) for key in self.traverse(traversal)))
+
+   # Returns minimum key of the tree (None if empty)
+   def min(self):
+      for key, data in self.walk():
+         return (key)
+      return (None)
+
+   # Returns maximum key of the tree (None if empty)
+   def max(self):
+      for key, data in self.walk(TRAVERSALS.REVERSE):
+         return (key)
+      return (None)
+
+   # Returns number of keys in the tree
+   def size(self):
+      return (self.__size)
+
+   # Number of pages in the file, including the header
+   def pages(self):
+      return (self.__pageCount)
+
+   # Commits every change since the last flush to the file; see the class
+   # comment.  The file is grown (and remapped) as needed.
+   def flush(self):
+      if (not self.__dirty and not self.__headerDirty):
+         return
+
+      # 1. Journal the original pages (and header) about to be overwritten
+      originals=[0]+[number for number in sorted(self.__dirty) if number < self.__committedPages]
+      journal=bytearray(BTree.MAGIC)
+      journal+=struct.pack("<II", self.pageSize, len(originals))
+      for number in originals:
+         journal+=struct.pack("<I", number)
+         journal+=self.__map[number*self.pageSize:(number+1)*self.pageSize]
+      journal+=struct.pack("<I", zlib.crc32(journal))
+      with open(self.journalPath, "wb") as f:
+         f.write(journal)
+         f.flush()
+         os.fsync(f.fileno())
+      self.__syncDirectory()
+
+      # 2. Write the pages, then the header
+      needed=self.__pageCount*self.pageSize
+      mapped=len(self.__map)
+      if (needed > mapped):
+         self.__map.close()
+         # Grow by at least an eighth, so remapping stays rare
+         self.__file.truncate(max(needed, mapped+mapped//8))
+         self.__map=mmap.mmap(self.__file.fileno(), 0)
+      for number, page in self.__dirty.items():
+         data=page.encode()
+         if (len(data) > self.pageSize):
+            raise ValueError(f"BTree page {number} overflowed")
+         self.__map[number*self.pageSize:number*self.pageSize+len(data)]=data
+      header=self.__header()
+      self.__map[0:len(header)]=header
+      self.__map.flush()
+
+      # 3. Deleting the journal commits
+      os.remove(self.journalPath)
+      self.__syncDirectory()
+      self.__committedPages=self.__pageCount
+      self.__dirty.clear()
+      self.__headerDirty=False
+      self.__evict()
+
+   # Flushes, and releases the file.  The tree can't be used afterwards.
+   def close(self):
+      if (self.__map is None):
+         return
+      self.flush()
+      self.__cache.clear()
+      self.__map.close()
+      self.__file.close()
+      self.__map=None
+
+   # Bulk loads a new tree file at 'path' (replacing any file there) from
+   # items in ascending key order (see _keyData()), and opens it.  Pages
+   # are written sequentially, filled to 'fill' of their size (leaving
+   # room for later inserts), with no journal or cache involved; the file
+   # only replaces 'path' once complete.  A repeated key updates the
+   # data; keys out of order raise ValueError.
+   @classmethod
+   def fromSorted(cls, path, items, pageSize=4096, cacheSize=256, fill=0.9):
+      temp=path+".tmp"
+      try:
+         with open(temp, "wb") as f:
+            loader=_BTreeLoader(f, pageSize, fill)
+            pending=None
+            for item in items:
+               key, data = _keyData(item)
+               if (pending is not None and not pending[0] < key):
+                  if (pending[0]==key):
+                     pending=(key, data)
+                     continue
+                  raise ValueError(f"fromSorted() keys out of order: {key!r} after {pending[0]!r}")
+               if (pending is not None):
+                  loader.add(pending)
+               pending=(key, data)
+            if (pending is not None):
+               loader.add(pending)
+            root, pageCount, size = loader.finish()
+
+            f.seek(0)
+            f.write(BTree.HEADER.pack(BTree.MAGIC, pageSize, root, pageCount, size))
+            f.flush()
+            os.fsync(f.fileno())
+      except BaseException:
+         os.remove(temp)
+         raise
+      if (os.path.exists(path+"-journal")):
+         os.remove(path+"-journal")
+      os.replace(temp, path)
+      return (cls(path, pageSize, cacheSize))
+
+   # Like fromSorted(), but sorts the items (in memory) first; for
+   # repeated keys, the last item wins.
+   @classmethod
+   def fromIterable(cls, path, items, pageSize=4096, cacheSize=256, fill=0.9):
+      entries=[_keyData(item) for item in items]
+      entries.sort(key=lambda entry: entry[0])
+      return (cls.fromSorted(path, entries, pageSize, cacheSize, fill))
+
+   # Snake case aliases, for the constructors
+   from_sorted=fromSorted
+   from_iterable=fromIterable
+
+# Writes a B-tree bottom up, for BTree.fromSorted().  levels[0] is the
+# leaf being filled, levels[1] its parent, and so on.  When a page is
+# full, the next entry goes up a level, as the separator between that
+# page and the next one; each finished page is written out, and becomes
+# a child of the page above.  Pages on the right edge may end up part
+# full (a leaf even empty), which searches and inserts handle as usual.
+class _BTreeLoader:
+   def __init__(self, f, pageSize, fill):
+      self.f=f
+      self.pageSize=pageSize
+      self.limit=int((pageSize-4)*fill)
+      self.levels=[]
+      self.used=[]
+      self.pageCount=1
+      self.size=0
+      # Page 0 is the header, written last
+      f.write(b"\0"*pageSize)
+
+   def __level(self, level):
+      while (len(self.levels) <= level):
+         self.levels.append(_BTreePage(0))
+         self.used.append(0)
+      return (self.levels[level])
+
+   # Writes a finished page, and returns its number
+   def __write(self, page):
+      data=_BTreePage(self.pageCount, page.keys, page.values, page.children).encode()
+      if (len(data) > self.pageSize):
+         raise ValueError("BTree page overflowed while bulk loading; lower 'fill'")
+      self.f.write(data.ljust(self.pageSize, b"\0"))
+      self.pageCount+=1
+      return (self.pageCount-1)
+
+   def __addChild(self, level, number):
+      self.__level(level).children.append(number)
+      self.used[level]+=5
+
+   def __addEntry(self, level, key, value, cost):
+      page=self.__level(level)
+      if (page.keys and self.used[level]+cost > self.limit):
+         # Page is full: finish it, and send this entry up
+         self.levels[level]=_BTreePage(0)
+         self.used[level]=0
+         self.__addChild(level+1, self.__write(page))
+         self.__addEntry(level+1, key, value, cost)
+         return
+      page.keys.append(key)
+      page.values.append(value)
+      self.used[level]+=cost
+
+   def add(self, entry):
+      key, value = entry
+      cost=_BTreePage.checkEntry(key, value, self.pageSize)
+      self.size+=1
+      self.__addEntry(0, key, value, cost)
+
+   # Writes the pages still open on each level; returns (root page,
+   # page count, number of keys)
+   def finish(self):
+      if (self.size==0):
+         return ((0, self.pageCount, 0))
+      for level in range(len(self.levels)):
+         page=self.levels[level]
+         number=self.__write(page)
+         if (level==len(self.levels)-1):
+            return ((number, self.pageCount, self.size))
+         self.__addChild(level+1, number)
+
 #*************************************************************************
 def printBanner():
       print(f"{'*'*75}")
@@ -584,6 +2381,13 @@ def testStack():
    print(f"Is stack object the same as copy? {stack==s}")
    print(f"Is stack data the same as copy's? {stack.toString()==s.toString()}")
 
+   # Test dump and load, through an in memory file
+   f=io.BytesIO()
+   stack.dump(f)
+   f.seek(0)
+   s=Stack.load(f)
+   print(f"Snapshot of {len(f.getvalue())} bytes; is loaded data the same? {stack.toString()==s.toString()}")
+
    # Test pop iteratively
    print (f"\nPopping all items off stack via iteration.")
    for data in stack:
@@ -636,6 +2440,18 @@ def testQueue():
    print(f"Is queue object the same as copy? {queue==q}")
    print(f"Is queue data the same as copy's? {queue.toString()==q.toString()}")
 
+   # Test dump and load, through an in memory file
+   f=io.BytesIO()
+   queue.dump(f)
+   f.seek(0)
+   q=Queue.load(f)
+   print(f"Snapshot of {len(f.getvalue())} bytes; is loaded data the same? {queue.toString()==q.toString()}")
+   try:
+      f.seek(0)
+      Stack.load(f)
+   except ValueError as e:
+      print(f"Loading it as a Stack raised ValueError, as it should: {e}")
+
    # Test iterative dequeue
    print (f"Dequeueing all items off stack via iteration...")
    for data in queue:
@@ -663,6 +2479,196 @@ def testQueue():
    print("Done testing Queue!")
 
 
+def testRingBuffer():
+   printBanner()
+   print("Class RingBuffer: Method Tests")
+   rb=RingBuffer(4)
+   rb.isdebug=True
+
+   # Test pushes at both ends, and refusal when full
+   rb.pushBack("bass guitar")
+   rb.pushBack("cello")
+   rb.pushFront("alto saxophone")
+   rb.append("drums")
+   print(f"Push onto full buffer, should be False: {rb.append('electric snare')}")
+   print(f"Front to Back view via str(rb):\n{rb}")
+   print(f"Front: {rb.front()}  Back: {rb.back()}  Size: {len(rb)} of {rb.capacity()}")
+
+   # Test pops at both ends
+   rb.isdebug=False
+   print(f"Pop front, should be alto saxophone: {rb.popFront()}")
+   print(f"Pop back, should be drums: {rb.popBack()}")
+
+   # Test deep copy and iteration
+   c=rb.copy()
+   print(f"Is copy data the same? {rb.toList()==c.toList()}")
+   print("Popping all items off copy via iteration.")
+   for data in c:
+      print(f"   Got: {data}")
+   print(f"Pop from empty, should be 'None': {c.popFront()} {c.popBack()}")
+
+   # Test overwrite (sliding window) with bulk extend and drain
+   window=RingBuffer(5, overwrite=True)
+   for i in range(8):
+      window.append(i)
+   print(f"Window after pushing 0..7, should be [3..7]: {window.toList()}")
+   window.extend(range(100, 103))
+   print(f"After extend 100..102, should be [6, 7, 100, 101, 102]: {window.toList()}")
+   print(f"Drain 2, should be [6, 7]: {window.drain(2)}, leaving {window.toList()}")
+   window.pushFront(99)
+   window.pushFront(98)
+   window.pushFront(97)
+   print(f"Push front onto full window drops back, should be [97, 98, 99, 100, 101]: {window.toList()}")
+
+   # Test extend with inputs that cannot be sliced directly
+   other=RingBuffer(4)
+   other.extend(deque([1, 2]))
+   other.extend({3: "a", 4: "b", 5: "c"})
+   print(f"Extend deque and dict keys into capacity 4, should be [1, 2, 3, 4]: {other.toList()}")
+
+   # Test typed storage
+   samples=RingBuffer(1000, overwrite=True, typecode="d")
+   samples.extend([x/10 for x in range(2500)])
+   print(f"Typed window of last 1,000 of 2,500 samples: {samples.peekFront()} .. {samples.peekBack()}, size {samples.size():,}")
+   if (np is not None):
+      samples=RingBuffer(1000, overwrite=True, dtype=np.float64)
+      samples.extend(np.arange(2500)/10)
+      print(f"NumPy window mean, should be 199.95: {samples.drain().mean():.2f}")
+
+   # Test clear
+   window.clear()
+   print(f"Size after clear, should be 0: {window.size()}")
+   print("Done testing RingBuffer!")
+
+def testBlockingQueue():
+   printBanner()
+   print("Class BlockingQueue, BlockingStack: Method Tests")
+
+   # Test order, and that None is an ordinary item
+   queue=BlockingQueue()
+   stack=BlockingStack()
+   for item in ["alto saxophone", None, "cello"]:
+      queue.put(item)
+      stack.push(item)
+   print(f"Queue order, should be saxophone, None, cello: {queue.getMany(10)}")
+   print(f"Stack order, should be cello, None, saxophone: {stack.get_many(10)}")
+
+   # Test timeouts, on empty and on full
+   bounded=BlockingQueue(maxsize=2)
+   try:
+      bounded.get(timeout=0.01)
+   except Empty:
+      print("Get from empty timed out, as it should.")
+   bounded.putMany([1, 2])
+   try:
+      bounded.put(3, block=False)
+   except Full:
+      print(f"Put onto full raised Full, as it should. Size: {bounded.size()}")
+
+   # Test putMany() filling up part way: Full says how many went in
+   bounded=BlockingQueue(maxsize=3)
+   bounded.put("first")
+   items=["a", "b", "c", "d"]
+   try:
+      bounded.putMany(items, timeout=0.01)
+   except Full as e:
+      print(f"putMany() of 4 with room for 2 raised Full, having added {e.added} (should be 2): {bounded.getMany(10)}")
+      print(f"Retrying with the rest adds {bounded.putMany(items[e.added:])} (should be 2): {bounded.getMany(10)}")
+
+   # Test producers and consumers with backpressure, then close
+   bounded=BlockingQueue(maxsize=16)
+   totals=[]
+   def consume():
+      total=0
+      for item in bounded:
+         total+=item
+      totals.append(total)
+   def produce(start):
+      for i in range(start, start+10000):
+         bounded.put(i)
+   consumers=[threading.Thread(target=consume) for i in range(3)]
+   producers=[threading.Thread(target=produce, args=(i*10000,)) for i in range(4)]
+   for thread in consumers+producers:
+      thread.start()
+   for thread in producers:
+      thread.join()
+   bounded.close()
+   for thread in consumers:
+      thread.join()
+   print(f"4 producers, 3 consumers; sum should be {sum(range(40000)):,}: {sum(totals):,}")
+
+   # Test put and get after close
+   try:
+      bounded.put(1)
+   except Closed:
+      print("Put after close raised Closed, as it should.")
+   try:
+      bounded.get()
+   except Closed:
+      print("Get from closed, empty queue raised Closed, as it should.")
+   print("Done testing BlockingQueue, BlockingStack!")
+
+def testAsyncQueue():
+   printBanner()
+   print("Class AsyncQueue, AsyncStack: Method Tests")
+
+   async def run():
+      # Test order, peek, and that None is an ordinary item
+      queue=AsyncQueue()
+      stack=AsyncStack()
+      for item in ["alto saxophone", None, "cello"]:
+         await queue.put(item)
+         await stack.push(item)
+      print(f"Queue peek, should be alto saxophone: {queue.peek()}  Stack top, should be cello: {stack.top()}")
+      print(f"Queue order, should be saxophone, None, cello: {await queue.getMany(10)}")
+      print(f"Stack order, should be cello, None, saxophone: {await stack.get_many(10)}")
+
+      # Test timeouts, on empty and on full
+      bounded=AsyncQueue(maxsize=2)
+      try:
+         await bounded.get(timeout=0.01)
+      except Empty:
+         print("Get from empty timed out, as it should.")
+      await bounded.putMany([1, 2])
+      try:
+         await bounded.put(3, timeout=0.01)
+      except Full:
+         print(f"Put onto full timed out, as it should. Size: {bounded.size()}")
+      print(f"Drain, should be [1, 2]: {bounded.drain()}")
+      try:
+         await bounded.putMany(["a", "b", "c"], timeout=0.01)
+      except Full as e:
+         print(f"putMany() of 3 with room for 2 raised Full, having added {e.added} (should be 2): {bounded.drain()}")
+
+      # Test producers and consumers with backpressure, then close
+      bounded=AsyncQueue(maxsize=16)
+      async def consume():
+         total=0
+         async for item in bounded:
+            total+=item
+         return (total)
+      async def produce(start):
+         for i in range(start, start+10000):
+            await bounded.put(i)
+      consumers=[asyncio.create_task(consume()) for i in range(3)]
+      await asyncio.gather(*[produce(i*10000) for i in range(4)])
+      bounded.close()
+      totals=await asyncio.gather(*consumers)
+      print(f"4 producers, 3 consumers; sum should be {sum(range(40000)):,}: {sum(totals):,}")
+
+      # Test put and get after close
+      try:
+         await bounded.put(1)
+      except Closed:
+         print("Put after close raised Closed, as it should.")
+      try:
+         await bounded.get()
+      except Closed:
+         print("Get from closed, empty queue raised Closed, as it should.")
+
+   asyncio.run(run())
+   print("Done testing AsyncQueue, AsyncStack!")
+
 def testBinaryTree():
    printBanner()
    print("Class BinaryTree: Method Tests")
@@ -702,12 +2708,15 @@ def testBinaryTree():
    print(f"The tree traversed in reverse order:\n{tree.traverse(TRAVERSALS.REVERSE)}")
    print(f"The tree traversed in pre-order:\n{tree.traverse(TRAVERSALS.PREORDER)}")
    print(f"The tree traversed in post-order:\n{tree.traverse(TRAVERSALS.POSTORDER)}")
+   print(f"The tree traversed in level order:\n{tree.traverse(TRAVERSALS.LEVELORDER)}")
 
    # Add data to a node (update) and test find
    tnode=TreeNode(17, "Why was there no '17 Candles'?")
    tree.insert(tnode)
    tnode=tree.find(17)
    print(f"Key: {tnode.key}  =  Data: {tnode.data}")
+   print(f"Data by lookup(), tree[17], and '17 in tree': {tree.lookup(17)} | {tree[17]} | {17 in tree}")
+   print(f"lookup() of a missing key, with a default: {tree.lookup(99, 'missing')}  '99 in tree': {99 in tree}")
 
    # toString with default, and optional param
    print()
@@ -723,21 +2732,437 @@ def testBinaryTree():
       tnode=TreeNode(random.randint(1,100))
       tnode.data=tnode.key**2
       tree.insert(tnode)
-   keys=tree.traverse(TRAVERSALS.INORDER)
-   for key in tree.traverse(TRAVERSALS.INORDER):
-      node=tree.search(key)
-      print (f"Key: {node.key}  |  Value: {node.data}")
-      
+   for key, data in tree:
+      print (f"Key: {key}  |  Value: {data}")
+
+   # Walk a degenerate (linked list) tree too deep for recursion
+   tree=BinaryTree()
+   for key in range(5000):
+      tree.insertKey(key)
+   walked=sum(1 for key, data in tree.walk(TRAVERSALS.POSTORDER))
+   print(f"Walked all {walked:,} nodes of a 5,000 deep tree in post-order.")
+
+   # Test delete: a leaf, a node with two children, the min and the max
+   print()
+   tree=BinaryTree()
+   for key in [10, 5, 15, 3, 7, 12, 20]:
+      tree.insertKey(key)
+   for key in [7, 10, 3, 20, 99]:
+      print(f"Delete {key:2}: {str(tree.delete(key)):5}  Tree: {tree.toString():14}  Min: {tree.min()}  Max: {tree.max()}")
+   tree.clear()
+   print(f"Size after clear, should be 0: {tree.size()}")
+
+   # Test balanced (AVL) mode; sorted keys would otherwise build a list
+   tree=BinaryTree(balanced=True)
+   for key in range(1, 1024):
+      tree.insertKey(key)
+   print(f"Balanced tree of 1,023 sorted keys, pre-order starts at the middle: {tree.traverse(TRAVERSALS.PREORDER)[:4]}")
+   for key in range(1, 1024, 2):
+      tree.delete(key)
+   print(f"After deleting odd keys: size {tree.size()}, min {tree.min()}, max {tree.max()}, first keys {tree.traverse()[:5]}")
+
+   # Test bulk loading, and balance()
+   tree=BinaryTree.fromSorted([(1, "one"), (2, "two"), (3, "three"), (4, "four"), (5, "five")])
+   print(f"fromSorted() pre-order, should be [3, 2, 1, 5, 4]: {tree.traverse(TRAVERSALS.PREORDER)}")
+   tree=BinaryTree.from_iterable([9, 4, TreeNode(7, "seven"), (1, "one"), 4])
+   print(f"from_iterable() contents: {list(tree)}  Min: {tree.min()}  Max: {tree.max()}")
+   try:
+      BinaryTree.fromSorted([3, 1, 2])
+   except ValueError as e:
+      print(f"Unsorted input raised ValueError, as it should: {e}")
+   tree=BinaryTree()
+   for key in range(1, 8):
+      tree.insertKey(key)
+   tree.balance()
+   print(f"Sorted inserts, then balance(); pre-order should be [4, 2, 1, 3, 6, 5, 7]: {tree.traverse(TRAVERSALS.PREORDER)}")
+
+   # Test range and order statistic queries, on keys 0, 10, ... 90
+   tree=BinaryTree.fromSorted([(key, f"t={key}") for key in range(0, 100, 10)], balanced=True)
+   print(f"range(25, 60), should be 30..60: {list(tree.range(25, 60))}")
+   print(f"floor(25)=20, ceiling(25)=30: {tree.floor(25)}, {tree.ceiling(25)}")
+   print(f"predecessor(30)=20, successor(30)=40: {tree.predecessor(30)}, {tree.successor(30)}")
+   print(f"floor(-1) and successor(90), should be None: {tree.floor(-1)}, {tree.successor(90)}")
+   print(f"rank(30)=3, rank(35)=4, select(3)=30, select(-1)=90: {tree.rank(30)}, {tree.rank(35)}, {tree.select(3)}, {tree.select(-1)}")
+   tree.delete(30)
+   print(f"After deleting 30, rank(35)=3, select(3)=40: {tree.rank(35)}, {tree.select(3)}")
+
+   # Test dump and load; the loaded tree has the same shape
+   f=io.BytesIO()
+   tree.dump(f)
+   f.seek(0)
+   loaded=BinaryTree.load(f)
+   print(f"Snapshot of {len(f.getvalue())} bytes; same pre-order? {loaded.traverse(TRAVERSALS.PREORDER)==tree.traverse(TRAVERSALS.PREORDER)}")
+   print(f"Loaded tree: balanced {loaded.isBalanced()}, size {loaded.size()}, min {loaded.min()}, max {loaded.max()}, select(3)={loaded.select(3)}")
+
    print()
    print("Done testing BinaryTree!")
 
+def testBTree():
+   printBanner()
+   print("Class BTree: Method Tests")
+   folder=tempfile.mkdtemp()
+   path=os.path.join(folder, "test.btree")
+   try:
+      # Small pages, so a few hundred keys make a tree several levels deep
+      tree=BTree(path, pageSize=256, cacheSize=8)
+      keys=list(range(500))
+      random.shuffle(keys)
+      for key in keys:
+         tree.insert(TreeNode(key, f"data {key}"))
+      tree.insertKey(2)
+      print(f"Inserted 500 keys (and a duplicate): size {tree.size()}, {tree.pages()} pages, min {tree.min()}, max {tree.max()}")
+      print(f"exists(499)=True, exists(500)=False: {tree.exists(499)}, {tree.exists(500)}")
+      print(f"search(17).data, lookup(2), 600 in tree: {tree.search(17).data!r}, {tree.lookup(2)!r}, {600 in tree}")
+      print(f"In order, first keys {tree.traverse()[:5]}; reversed {tree.traverse(TRAVERSALS.REVERSE)[:5]}")
+      try:
+         tree.walk(TRAVERSALS.PREORDER)
+         print("walk(PREORDER) returned a generator, which it should not")
+      except ValueError as e:
+         print(f"walk(PREORDER) raised ValueError straight away, as it should: {e}")
+      tree.close()
+
+      # Reopening reads only the header; pages are read as needed
+      with BTree(path) as tree:
+         print(f"Reopened: size {len(tree)}, tree[250]={tree[250]!r}, in order: {tree.traverse()==list(range(500))}")
+         tree.insert(TreeNode(1000, "after reopen"))
+         tree.insert(TreeNode(1001, "flushed on close"))
+
+      # A crash during a flush leaves its journal behind.  Fake one, with
+      # the images of every page as they were before inserting 2000.
+      with open(path, "rb") as f:
+         original=f.read()
+      pageSize=struct.unpack_from("<I", original, 8)[0]
+      count=len(original)//pageSize
+      journal=bytearray(BTree.MAGIC)+struct.pack("<II", pageSize, count)
+      for number in range(count):
+         journal+=struct.pack("<I", number)+original[number*pageSize:(number+1)*pageSize]
+      journal+=struct.pack("<I", zlib.crc32(journal))
+      with BTree(path) as tree:
+         tree.insert(TreeNode(2000, "lost in a crash"))
+      with open(path+"-journal", "wb") as f:
+         f.write(journal)
+      with BTree(path) as tree:
+         print(f"Journal rolled back: 2000 in tree={2000 in tree}, 1001 in tree={1001 in tree}, size {tree.size()}")
+
+      # Bulk loading
+      tree=BTree.fromSorted(path, [(key, key*key) for key in range(10000)], pageSize=512)
+      print(f"fromSorted() 10000 keys: {tree.pages()} pages, tree[99]={tree[99]}, in order: {tree.traverse()==list(range(10000))}")
+      tree.insertKey(-1)
+      print(f"Insert after bulk load, min {tree.min()}, size {tree.size()}")
+      tree.close()
+      tree=BTree.from_iterable(path, [9, 4, TreeNode(7, "seven"), (1, "one"), 4])
+      print(f"from_iterable() contents: {list(tree)}")
+      tree.close()
+      try:
+         BTree.fromSorted(path, [3, 1, 2])
+      except ValueError as e:
+         print(f"Unsorted input raised ValueError, as it should: {e}")
+
+      # An entry of exactly the largest size goes in through insert(),
+      # and the tree's own items bulk load back; one byte more fails both
+      tree=BTree(path+"2", pageSize=256)
+      data="x"
+      while (_BTreePage.entrySize(1, data+"x") <= tree.maxEntry):
+         data+="x"
+      tree.insert(TreeNode(1, data))
+      tree.insertKey(2)
+      items=list(tree)
+      tree.close()
+      tree=BTree.fromSorted(path, items, pageSize=256)
+      print(f"Largest entry ({_BTreePage.entrySize(1, data)} bytes) round trips through insert() and fromSorted(): {list(tree)==items}")
+      tree.close()
+      refused=0
+      tree=BTree(path+"2")
+      for load in [lambda: tree.insert(TreeNode(3, data+"x")),
+                   lambda: BTree.fromSorted(path, [(3, data+"x")], pageSize=256)]:
+         try:
+            load()
+         except ValueError:
+            refused+=1
+      tree.close()
+      print(f"One byte larger is refused by both, should be 2: {refused}")
+   finally:
+      shutil.rmtree(folder)
+
+   print()
+   print("Done testing BTree!")
+
+# Enqueue/dequeue throughput of Queue, against the list with pop(0) it
+# used to be built on.  Draining a list is quadratic, so the list
+# baseline is skipped past 'listLimit' elements.
+def benchmarkQueue(sizes=(10**3, 10**4, 10**5, 10**6, 10**7), listLimit=10**5):
+   printBanner()
+   print("Queue throughput: n enqueues, then n dequeues (million ops/s)")
+   print(f"{'Elements':>12} {'list pop(0)':>12} {'Queue':>12}")
+   timer=Timer()
+   for n in sizes:
+      baseline="skipped"
+      if (n<=listLimit):
+         items=[]
+         timer.start()
+         for i in range(n):
+            items.append(i)
+         while (len(items)>0):
+            items.pop(0)
+         baseline=f"{2*n/timer.elapsed('s')/1e6:12.2f}"
+
+      queue=Queue()
+      timer.start()
+      for i in range(n):
+         queue.enqueue(i)
+      while (queue.size()>0):
+         queue.dequeue()
+      rate=2*n/timer.elapsed("s")/1e6
+      print(f"{n:12,} {baseline:>12} {rate:12.2f}")
+
+# Producer/consumer throughput of AsyncQueue against asyncio.Queue: one
+# producer puts n items through a queue bounded to 'maxsize' (0 for
+# unbounded), while one consumer gets them, singly or with getMany().
+def benchmarkAsyncQueue(sizes=(10**4, 10**5, 10**6), maxsize=128, batch=64):
+   async def single(queue, n):
+      async def produce():
+         for i in range(n):
+            await queue.put(i)
+      async def consume():
+         for i in range(n):
+            await queue.get()
+      await asyncio.gather(produce(), consume())
+
+   async def batched(queue, n):
+      async def produce():
+         for i in range(n):
+            await queue.put(i)
+      async def consume():
+         count=0
+         while (count<n):
+            count+=len(await queue.getMany(batch))
+      await asyncio.gather(produce(), consume())
+
+   async def measure(run, queue, n):
+      timer=Timer()
+      timer.start()
+      await run(queue, n)
+      return (n/timer.elapsed("s")/1e6)
+
+   printBanner()
+   print(f"Async queue throughput, maxsize={maxsize} (million items/s)")
+   print(f"{'Items':>12} {'asyncio.Queue':>14} {'AsyncQueue':>11} {'getMany':>9}")
+   for n in sizes:
+      baseline=asyncio.run(measure(single, asyncio.Queue(maxsize), n))
+      rate=asyncio.run(measure(single, AsyncQueue(maxsize), n))
+      bulk=asyncio.run(measure(batched, AsyncQueue(maxsize), n))
+      print(f"{n:12,} {baseline:14.2f} {rate:11.2f} {bulk:9.2f}")
+
+# Insert, search and delete times for plain and balanced BinaryTrees,
+# with sorted, reverse sorted and random keys.  Sorted keys turn a plain
+# tree into a linked list (O(n) per operation), so plain trees are
+# skipped past 'plainLimit' keys.
+def benchmarkBinaryTree(sizes=(1000, 10000, 100000), plainLimit=10000):
+   printBanner()
+   print("BinaryTree: µs per insert / search / delete")
+   print(f"{'Keys':>9} {'Order':>8} {'Plain':>24} {'Balanced':>24}")
+   timer=Timer()
+   for n in sizes:
+      shuffled=list(range(n))
+      random.shuffle(shuffled)
+      workloads={"sorted": list(range(n)), "reverse": list(range(n-1, -1, -1)), "random": shuffled}
+      for order, keys in workloads.items():
+         results=[]
+         for balanced in [False, True]:
+            if (not balanced and n>plainLimit and order!="random"):
+               results.append(f"{'skipped':>24}")
+               continue
+            tree=BinaryTree(balanced=balanced)
+            times=[]
+            for operation in [tree.insertKey, tree.exists, tree.delete]:
+               timer.start()
+               for key in keys:
+                  operation(key)
+               times.append(timer.elapsed("µs")/n)
+            results.append(f"{times[0]:7.2f} {times[1]:7.2f} {times[2]:7.2f} ")
+         print(f"{n:9,} {order:>8} {results[0]} {results[1]}")
+
+# Building a tree of n random keys: one insert per key, against
+# fromIterable() (which sorts) and fromSorted() (given sorted keys).
+def benchmarkBulkLoad(sizes=(10**4, 10**5, 10**6)):
+   printBanner()
+   print("BinaryTree bulk load: seconds to build")
+   print(f"{'Keys':>11} {'insert()':>10} {'fromIterable':>13} {'fromSorted':>11}")
+   timer=Timer()
+   for n in sizes:
+      keys=list(range(n))
+      random.shuffle(keys)
+
+      tree=BinaryTree()
+      timer.start()
+      for key in keys:
+         tree.insertKey(key)
+      inserted=timer.elapsed("s")
+
+      timer.start()
+      tree=BinaryTree.fromIterable(keys)
+      iterable=timer.elapsed("s")
+
+      timer.start()
+      tree=BinaryTree.fromSorted(range(n))
+      ordered=timer.elapsed("s")
+      print(f"{n:11,} {inserted:10.3f} {iterable:13.3f} {ordered:11.3f}")
+
+# BTree against its file: bulk load, reopen, random lookups and inserts
+# (seconds, or µs per operation).  Reopening reads only the header, so
+# it takes the same time at any size.
+def benchmarkBTree(sizes=(10**4, 10**5, 10**6), lookups=100000):
+   printBanner()
+   print("BTree (4 KiB pages, 256 page cache) on disk")
+   print(f"{'Keys':>11} {'fromSorted':>11} {'Reopen':>9} {'lookup()':>10} {'insert()':>10} {'File MiB':>9}")
+   folder=tempfile.mkdtemp()
+   path=os.path.join(folder, "bench.btree")
+   timer=Timer()
+   try:
+      for n in sizes:
+         timer.start()
+         tree=BTree.fromSorted(path, range(0, 2*n, 2))
+         loaded=timer.elapsed("s")
+         tree.close()
+
+         timer.start()
+         tree=BTree(path)
+         opened=timer.elapsed("ms")
+
+         keys=[random.randrange(2*n) for i in range(lookups)]
+         timer.start()
+         for key in keys:
+            tree.lookup(key)
+         looked=timer.elapsed("µs")/lookups
+
+         timer.start()
+         for key in keys:
+            tree.insertKey(key | 1)
+         tree.flush()
+         inserted=timer.elapsed("µs")/lookups
+         tree.close()
+         print(f"{n:11,} {loaded:9.3f} s {opened:6.2f} ms {looked:7.2f} µs {inserted:7.2f} µs {os.path.getsize(path)/2**20:9.1f}")
+   finally:
+      shutil.rmtree(folder)
+
+# Snapshot throughput: dump() to and load() from a file, against
+# rebuilding the structure by replaying every push/enqueue/insert (the
+# only way back before snapshots).  Trees are balanced, with random
+# keys; the string data makes snapshots a realistic size.
+def benchmarkSnapshot(sizes=(10**4, 10**5, 10**6)):
+   printBanner()
+   print("Snapshots through a file: seconds, and MiB/s of snapshot")
+   print(f"{'Structure':>10} {'Items':>11} {'MiB':>7} {'dump()':>8} {'MiB/s':>7} {'load()':>8} {'MiB/s':>7} {'Replay':>8}")
+   folder=tempfile.mkdtemp()
+   path=os.path.join(folder, "bench.snapshot")
+   timer=Timer()
+   try:
+      for n in sizes:
+         keys=random.sample(range(10*n), n)
+         items=[f"item {key}" for key in keys]
+
+         timer.start()
+         stack=Stack()
+         for item in items:
+            stack.push(item)
+         stackReplay=timer.elapsed("s")
+
+         timer.start()
+         queue=Queue()
+         for item in items:
+            queue.enqueue(item)
+         queueReplay=timer.elapsed("s")
+
+         timer.start()
+         tree=BinaryTree(balanced=True)
+         for key, item in zip(keys, items):
+            tree.insert(TreeNode(key, item))
+         treeReplay=timer.elapsed("s")
+
+         for name, structure, cls, replay in [("Stack", stack, Stack, stackReplay),
+                                              ("Queue", queue, Queue, queueReplay),
+                                              ("BinaryTree", tree, BinaryTree, treeReplay)]:
+            timer.start()
+            with open(path, "wb") as f:
+               structure.dump(f)
+            dumped=timer.elapsed("s")
+            mib=os.path.getsize(path)/2**20
+
+            timer.start()
+            with open(path, "rb") as f:
+               cls.load(f)
+            loaded=timer.elapsed("s")
+            print(f"{name:>10} {n:11,} {mib:7.1f} {dumped:8.3f} {mib/dumped:7.0f} {loaded:8.3f} {mib/loaded:7.0f} {replay:8.3f}")
+   finally:
+      shutil.rmtree(folder)
+
+# Memory per key of a BinaryTree of n keys, measured with tracemalloc,
+# for TreeNode (with __slots__) against the layout it replaced (a plain
+# object with a __dict__), plus lookup() against search().
+def benchmarkMemory(n=10**6):
+   # The layout TreeNode had before __slots__
+   class DictTreeNode:
+      def __init__(self, key, data=None):
+         self.key=key
+         self.data=data
+         self.leftChild=None
+         self.rightChild=None
+         self.height=1
+         self.size=1
+
+   printBanner()
+   print(f"BinaryTree memory at {n:,} keys (bytes per key, including the key)")
+   gc.collect()
+   tracemalloc.start()
+
+   # A tree made of each node layout; the list of nodes is freed before
+   # measuring, so only the tree is counted
+   start=tracemalloc.get_traced_memory()[0]
+   nodes=[DictTreeNode(key) for key in range(n)]
+   for i in range(1, n):
+      nodes[i-1].rightChild=nodes[i]
+   root=nodes[0]
+   del nodes
+   dictBytes=tracemalloc.get_traced_memory()[0]-start
+   del root
+
+   start=tracemalloc.get_traced_memory()[0]
+   tree=BinaryTree.fromSorted(range(n))
+   slotBytes=tracemalloc.get_traced_memory()[0]-start
+   tracemalloc.stop()
+
+   print(f"{'__dict__ nodes (before)':>26}: {dictBytes/n:7.1f}")
+   print(f"{'__slots__ TreeNode':>26}: {slotBytes/n:7.1f}")
+
+   timer=Timer()
+   keys=random.sample(range(n), min(n, 100000))
+   for name, fn in [("search()", tree.search), ("lookup()", tree.lookup)]:
+      timer.start()
+      for key in keys:
+         fn(key)
+      print(f"{name:>26}: {timer.elapsed('µs')/len(keys):7.2f} µs per lookup")
+
 def main():
    testStack()
    testQueue()
+   testRingBuffer()
+   testBlockingQueue()
+   testAsyncQueue()
    testBinaryTree()
+   testBTree()
    printBanner()
    print("DONE.")
 
+# Unit tests; use 'python datastructures.py bench' for the benchmarks
 if (__name__=="__main__"):
-   main()
+   if (len(sys.argv) > 1 and sys.argv[1]=="bench"):
+      benchmarkQueue()
+      benchmarkAsyncQueue()
+      benchmarkBinaryTree()
+      benchmarkBulkLoad()
+      benchmarkMemory()
+      benchmarkBTree()
+      benchmarkSnapshot()
+   else:
+      main()
 
@@ -1,5 +1,24 @@
+import os
+import re
+import sys
 import random
+import math
+import operator
+import functools
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from statistics import NormalDist
 from datastructures import Stack, Queue
+from timer import Timer
+
+# NumPy is optional; it powers the batch (vectorized) rolling engine.
+# Without it, resolveMany() falls back to rolling one trial at a time.
+try:
+   import numpy as np
+except ImportError:
+   np = None
 
 # Karim Sultan 2021 08 12
 # Adapted from C# version, DiceResolver.cs by Karim Sultan, 2019.
@@ -15,6 +34,547 @@ from datastructures import Stack, Queue
 # Dice: "3d6" would resolve to the range 3-18.
 # Mixed: "2d4 + 3d6 - 1" would resolve to the range 4-25.
 # Faulty: "(9*7" = 0 or "*oas" = 0 (error always returns 0).
+# The reason (and position) of the error is raised by compile() as a
+# DiceSyntaxError, and kept in 'lastError' by resolve().  Expressions
+# which would take too long, like "5000!" or "1000000000d6", fail with
+# a DiceLimitError; see estimateCost() and checkBudget().
+
+# Probability distribution of an expression's outcomes.  Outcomes are
+# stored as integer counts (weights) over an integer total, so every
+# probability is an exact ratio; no floating point drift accumulates
+# while convolving.  When 'exact' is False, the counts are trial results
+# from a Monte Carlo estimate and 'total' is the number of trials.
+class Distribution:
+   def __init__(self, counts=None, total=0, exact=True):
+      self.counts = counts if counts else {}
+      self.total = total
+      self.exact = exact
+
+   # A distribution with a single certain outcome (a constant)
+   @staticmethod
+   def constant(value):
+      return (Distribution({value: 1}, 1))
+
+   # Distribution of the sum of 'n' rolls of an 'm' sided die, with
+   # optional DiceModifiers (see roll()).  Dice are summed by
+   # exponentiation by squaring, so 100d6 needs only ~7 convolutions.
+   # Raises OverflowError if the work would exceed 'limit'.
+   @staticmethod
+   def dice(n, m, limit, modifiers=None, maxExplosions=0):
+      if (n<=0):
+         return (Distribution.constant(0))
+      if (m<1):
+         raise ValueError(f"Die must have at least one side: {n}d{m}")
+      if (Distribution.diceCost(n, m, modifiers, maxExplosions) > limit):
+         raise OverflowError("Outcome space too large for exact distribution")
+
+      if (modifiers is None):
+         die=Distribution({face: 1 for face in range(1, m+1)}, m)
+      else:
+         die=Distribution.die(m, modifiers, maxExplosions, limit)
+         if (modifiers.keep is not None):
+            return (Distribution.keep(die, n, modifiers.keep, modifiers.highest, limit))
+      return (Distribution.power(die, n, limit))
+
+   # Estimated work (outcome pairings, or states visited) of dice(), from
+   # the dice count, sides and explosion depth alone, so a roll too big
+   # to convolve fails at once instead of part way through.  The outcome
+   # space of one exploding die grows by a die's faces per explosion.
+   @staticmethod
+   def diceCost(n, m, modifiers, maxExplosions):
+      threshold=m
+      if (modifiers is not None and modifiers.explode):
+         threshold=modifiers.explode
+      explodes = modifiers is not None and modifiers.explode is not None and maxExplosions > 0 and threshold <= m
+      if (explodes):
+         # Each level of die() pairs the exploding faces with the
+         # outcomes so far (half the final space, on average)
+         support=m*(maxExplosions+1) - maxExplosions
+         cost=maxExplosions*(m + (m-threshold+1)*support//2)
+      else:
+         support=m
+         cost=0
+
+      if (modifiers is not None and modifiers.keep is not None):
+         # States are (dice placed, sum kept), for each distinct face
+         k=min(modifiers.keep, n)
+         largest=m*(maxExplosions+1) if explodes else m
+         return (cost + support*(n+1)*(n+1)*(k*largest+1)//2)
+
+      # The convolutions of power(), with j dice summing to at most
+      # j*(support-1)+1 distinct outcomes
+      result=0
+      power=1
+      while True:
+         if (n & 1):
+            if (result):
+               cost+=(result*(support-1)+1) * (power*(support-1)+1)
+            result+=power
+         n >>= 1
+         if (n==0):
+            return (cost)
+         cost+=(power*(support-1)+1)**2
+         power*=2
+
+   # Distribution of one 'm' sided die after its rerolls and explosions.
+   # A reroll replaces a first roll of 'reroll' or less with a new roll:
+   # over a total of m*m, faces up to 'reroll' then weigh 'reroll' and
+   # faces above it weigh m+reroll.  An exploding die adds another roll
+   # whenever it shows 'explode' or more, up to maxExplosions times.
+   @staticmethod
+   def die(m, modifiers, maxExplosions, limit):
+      if (modifiers.reroll is None):
+         first=Distribution({face: 1 for face in range(1, m+1)}, m)
+      else:
+         r=min(modifiers.reroll, m)
+         first=Distribution({face: (r if face<=r else m+r) for face in range(1, m+1)}, m*m)
+
+      if (modifiers.explode is None):
+         return (first)
+      threshold=modifiers.explode if modifiers.explode else m
+
+      # Build outwards from the last roll allowed, which can't explode
+      extra=Distribution({face: 1 for face in range(1, m+1)}, m)
+      for level in range(maxExplosions):
+         if (level==maxExplosions-1):
+            base=first
+         else:
+            base=Distribution({face: 1 for face in range(1, m+1)}, m)
+         if (len(extra) * m > limit):
+            raise OverflowError("Outcome space too large for exact distribution")
+         counts={}
+         for face, weight in base.counts.items():
+            if (face < threshold):
+               counts[face] = counts.get(face, 0) + weight*extra.total
+            else:
+               for value, count in extra.counts.items():
+                  counts[face+value] = counts.get(face+value, 0) + weight*count
+         extra=Distribution(counts, base.total*extra.total)
+
+      if (maxExplosions==0):
+         return (first)
+      return (extra)
+
+   # Distribution of the sum of 'n' independent copies of a distribution
+   @staticmethod
+   def power(die, n, limit):
+      result=None
+      power=die
+      while True:
+         if (n & 1):
+            result = power if result is None else result.combine(power, operator.add, limit)
+         n >>= 1
+         if (n==0):
+            return (result)
+         power=power.combine(power, operator.add, limit)
+
+   # Distribution of the sum of the 'k' highest (or lowest) of 'n' dice.
+   # Dynamic programming over the order statistics: faces are visited
+   # best first, choosing how many of the remaining dice show each face
+   # (with multinomial weights).  Dice visited first are the ones kept,
+   # so the state is just (dice placed, sum kept).
+   @staticmethod
+   def keep(die, n, k, highest, limit):
+      faces=sorted(die.counts, reverse=highest)
+      state={(0, 0): 1}
+      work=0
+
+      for face in faces:
+         weight=die.counts[face]
+         nextstate={}
+         for (placed, kept), count in state.items():
+            work+=n-placed+1
+            if (work > limit):
+               raise OverflowError("Outcome space too large for exact distribution")
+            ways=count
+            for c in range(0, n-placed+1):
+               total=kept + (min(placed+c, k) - min(placed, k)) * face
+               key=(placed+c, total)
+               nextstate[key] = nextstate.get(key, 0) + ways * math.comb(n-placed, c)
+               ways*=weight
+         state=nextstate
+
+      counts={}
+      for (placed, kept), count in state.items():
+         if (placed==n):
+            counts[kept] = counts.get(kept, 0) + count
+      return (Distribution(counts, die.total**n))
+
+   # Mixes weighted distributions into one.  'parts' is a list of
+   # (weight, distribution) tuples; used when the number of dice or
+   # sides is itself random, ie (1d4)d6.
+   @staticmethod
+   def mix(parts):
+      if (len(parts)==1):
+         return (parts[0][1])
+
+      # Common denominator across all parts keeps the counts integral
+      lcm=1
+      weight=0
+      for w, d in parts:
+         lcm = lcm * d.total // math.gcd(lcm, d.total)
+         weight+=w
+
+      counts={}
+      for w, d in parts:
+         scale = w * (lcm // d.total)
+         for value, count in d.counts.items():
+            counts[value] = counts.get(value, 0) + count*scale
+      return (Distribution(counts, weight*lcm))
+
+   # Combines two independent distributions with a binary function,
+   # by discrete convolution (every pair of outcomes).
+   def combine(self, other, fn, limit):
+      if (len(self.counts) * len(other.counts) > limit):
+         raise OverflowError("Outcome space too large for exact distribution")
+
+      counts={}
+      for a, ca in self.counts.items():
+         for b, cb in other.counts.items():
+            value=fn(a, b)
+            counts[value] = counts.get(value, 0) + ca*cb
+      return (Distribution(counts, self.total*other.total, self.exact and other.exact))
+
+   # Applies a single argument function to every outcome
+   def map(self, fn):
+      counts={}
+      for a, ca in self.counts.items():
+         value=fn(a)
+         counts[value] = counts.get(value, 0) + ca
+      return (Distribution(counts, self.total, self.exact))
+
+   # Produced number of distinct outcomes
+   def __len__(self):
+      return (len(self.counts))
+
+   # Allows conversion of object to string by Python natives
+   def __str__(self):
+      return (self.toString())
+
+   # Probability (0..1) of a given outcome
+   def probability(self, value):
+      if (self.total==0):
+         return (0.0)
+      return (self.counts.get(value, 0) / self.total)
+
+   # Exact probability of a given outcome, as a Fraction
+   def fraction(self, value):
+      if (self.total==0):
+         return (Fraction(0))
+      return (Fraction(self.counts.get(value, 0), self.total))
+
+   # Dictionary of outcome -> probability, sorted by outcome
+   def probabilities(self):
+      return ({value: self.probability(value) for value in sorted(self.counts)})
+
+   def mean(self):
+      if (self.total==0):
+         return (0.0)
+      return (sum(v*c for v, c in self.counts.items()) / self.total)
+
+   # Computed in integers first, E[X^2]*n - E[X]^2, to stay exact
+   # until the final division.
+   def variance(self):
+      if (self.total==0):
+         return (0.0)
+      s1=sum(v*c for v, c in self.counts.items())
+      s2=sum(v*v*c for v, c in self.counts.items())
+      return ((s2*self.total - s1*s1) / (self.total*self.total))
+
+   def stddev(self):
+      return (math.sqrt(self.variance()))
+
+   # Most likely outcome; lowest outcome wins a tie
+   def mode(self):
+      if (not self.counts):
+         return (None)
+      return (max(sorted(self.counts), key=lambda v: self.counts[v]))
+
+   def min(self):
+      return (min(self.counts) if self.counts else None)
+
+   def max(self):
+      return (max(self.counts) if self.counts else None)
+
+   # Smallest outcome with at least a fraction q (0..1) of the
+   # distribution at or below it.  quantile(0.5) is the median.
+   def quantile(self, q):
+      if (not self.counts):
+         return (None)
+      target=q*self.total
+      cumulative=0
+      for value in sorted(self.counts):
+         cumulative+=self.counts[value]
+         if (cumulative >= target):
+            return (value)
+      return (value)
+
+   # Same as quantile(), with p as a percentage (0..100)
+   def percentile(self, p):
+      return (self.quantile(p/100.0))
+
+   # Report in the same spirit as getHistogram()
+   def toString(self):
+      kind = "EXACT" if self.exact else f"ESTIMATED ({self.total:,} trials)"
+      sb=f"{kind} DISTRIBUTION:\n"
+      for value, pct in self.probabilities().items():
+         sb+=f"[{value:3}] ==> {pct*100.0:.4f}%\n"
+      sb+=f"Mean: {self.mean():.4f}\n"
+      sb+=f"Variance: {self.variance():.4f}\n"
+      sb+=f"Mode: {self.mode()}\n"
+      return (sb)
+
+
+# A Monte Carlo histogram that can be grown incrementally.  Created by
+# DiceResolver.histogram(expression), it rolls more trials on demand with
+# addTrials(), can merge with other histograms of the same expression,
+# and can stream snapshots while it runs (see stream()), so long runs can
+# report progress and stop once the estimate is good enough.
+class Histogram(Distribution):
+   def __init__(self, dice=None, expression=None):
+      super().__init__(exact=False)
+      self.dice=dice
+      self.expression=expression
+
+   # Rolls n more trials and adds them in
+   def addTrials(self, n):
+      return (self.addCounts(self.dice.countRolls(self.expression, n)))
+
+   # Adds a dictionary of outcome -> count
+   def addCounts(self, counts):
+      for value, count in counts.items():
+         self.counts[value] = self.counts.get(value, 0) + count
+         self.total+=count
+      return (self)
+
+   # Adds another histogram's trials into this one
+   def merge(self, other):
+      return (self.addCounts(other.counts))
+
+   # Makes a deep copy of itself
+   def copy(self):
+      histogram=Histogram(self.dice, self.expression)
+      histogram.counts=dict(self.counts)
+      histogram.total=self.total
+      return (histogram)
+
+   # Standard normal score for a two sided confidence level, ie 1.96 for 0.95
+   @staticmethod
+   def zScore(confidence):
+      return (NormalDist().inv_cdf(0.5 + confidence/2.0))
+
+   # Confidence interval for the true mean, as a (low, high) tuple
+   def meanInterval(self, confidence=0.95):
+      if (self.total < 2):
+         return ((float("-inf"), float("inf")))
+      margin=self.zScore(confidence) * math.sqrt(self.variance()/self.total)
+      mean=self.mean()
+      return ((mean-margin, mean+margin))
+
+   # Confidence interval for the true probability of one outcome, as a
+   # (low, high) tuple.  Uses the Wilson score, which behaves for rare
+   # outcomes where the plain normal approximation does not.
+   def probabilityInterval(self, value, confidence=0.95):
+      if (self.total==0):
+         return ((0.0, 1.0))
+      z=self.zScore(confidence)
+      n=self.total
+      p=self.probability(value)
+      centre=(p + z*z/(2*n)) / (1 + z*z/n)
+      margin=(z / (1 + z*z/n)) * math.sqrt(p*(1-p)/n + z*z/(4*n*n))
+      return ((max(0.0, centre-margin), min(1.0, centre+margin)))
+
+   # Generator which rolls up to 'trials' more trials in batches,
+   # yielding a snapshot (a copy) after each batch.  If 'tolerance' is set,
+   # stops early once the mean is known to within +/- tolerance at the
+   # given confidence level.
+   def stream(self, trials, batch=100000, tolerance=None, confidence=0.95):
+      done=0
+      while (done < trials):
+         n=min(batch, trials-done)
+         self.addTrials(n)
+         done+=n
+         yield (self.copy())
+
+         if (tolerance is not None):
+            low, high = self.meanInterval(confidence)
+            if ((high-low)/2.0 <= tolerance):
+               return
+
+   # Snake case alias
+   add_trials=addTrials
+
+
+# Base class for errors raised by the dice module.
+class DiceError(ValueError):
+   pass
+
+# Raised when an expression can't be parsed.  'position' is the index
+# into 'expression' where the problem was found.
+class DiceSyntaxError(DiceError):
+   def __init__(self, message, expression, position):
+      super().__init__(f"{message} at position {position}")
+      self.message=message
+      self.expression=expression
+      self.position=position
+
+   # Shows the expression with a caret under the error
+   def toString(self):
+      return (f"{self.expression}\n{' '*self.position}^ {self.message}")
+
+# Raised when an expression would exceed one of the resolver's
+# evaluation limits, such as 'maxFactorial'.
+class DiceLimitError(DiceError):
+   pass
+
+# A lexical token.  'kind' is one of "number", "operator", "modifier",
+# "lparen" or "rparen"; 'value' is the token text, and 'position' its index.
+Token = namedtuple("Token", ["kind", "value", "position"])
+
+# One pass tokenizer; the group name that matched is the token kind.
+_TOKENS = re.compile(r"(?P<space>\s+)|(?P<number>\d+)|(?P<modifier>(?:kh|kl|x|r)\d*)|(?P<operator>[-+*/%^!Ccd])|(?P<lparen>\()|(?P<rparen>\))")
+
+# Dice modifiers are fused onto their 'd' operator by the parser, so the
+# RPN token for "4d6kh3r1" is "dkh3r1".
+_MODIFIER = re.compile(r"(kh|kl|x|r)(\d*)")
+
+# Modifiers of a dice roll.  'keep' is how many dice count (None for all)
+# and 'highest' whether those are the highest or lowest.  'reroll' is the
+# face at or below which a die is rerolled once (None for no rerolls).
+# 'explode' is the face at or above which a die rolls again and adds; 0
+# means the die's maximum, None no explosions.
+DiceModifiers = namedtuple("DiceModifiers", ["keep", "highest", "reroll", "explode"])
+
+# Parses a fused dice operator, ie "dkh3r1", into DiceModifiers, or None
+# for a plain "d".
+@functools.lru_cache(maxsize=256)
+def _diceModifiers(op):
+   if (len(op)==1):
+      return (None)
+   keep=reroll=explode=None
+   highest=True
+   for kind, count in _MODIFIER.findall(op, 1):
+      if (kind=="kh" or kind=="kl"):
+         keep=int(count) if count else 1
+         highest = kind=="kh"
+      elif (kind=="r"):
+         reroll=int(count) if count else 1
+      else:
+         explode=int(count) if count else 0
+   return (DiceModifiers(keep, highest, reroll, explode))
+
+# Raised inside a compiled program when an operand fails validation
+# (the same rule evaluateRPN() applies); evaluate() turns it into 0.
+class _InvalidOperand(Exception):
+   pass
+
+def _invalidProgram(dice):
+   raise _InvalidOperand()
+
+# Outcome of an exact distribution for the trials which fail validation;
+# it absorbs every operation, and resolves to 0 once the walk is done.
+_INVALID = _InvalidOperand
+
+# Operator implementations for compiled programs.  Each takes the
+# resolver (for dice and the factorial/choose routines) and both operands.
+_OPERATIONS = {
+   "+": lambda dice, left, right: left + right,
+   "-": lambda dice, left, right: left - right,
+   "*": lambda dice, left, right: left * right,
+   "/": lambda dice, left, right: dice.divide(left, right),
+   "^": lambda dice, left, right: dice.power(left, right),
+   "%": lambda dice, left, right: left % right,
+   "!": lambda dice, left, right: dice.factorial(left),
+   "C": lambda dice, left, right: dice.choose(left, right),
+   "c": lambda dice, left, right: dice.choose(left, right),
+   "d": lambda dice, left, right: dice.roll(left, right)
+}
+
+# Static estimate of what evaluating an expression costs: the number of
+# dice drawn, and the bit width of the result (or of any intermediate),
+# as upper bounds.  Both saturate at _COST_CEILING.
+ExpressionCost = namedtuple("ExpressionCost", ["draws", "bits"])
+
+# Deepest expression tree compiled to nested closures; deeper ones are
+# evaluated iteratively (see DiceResolver.__build()).
+_PROGRAM_DEPTH = 200
+
+# Widest value (in bits, excluding the sign) the int64 batch engine can
+# hold; see resolveMany().
+_BATCH_BITS = 62
+
+# Cost estimates stop growing here; anything this big is rejected anyway.
+_COST_CEILING_BITS = 1 << 16
+_COST_CEILING = 1 << _COST_CEILING_BITS
+
+# A compiled expression: the original infix string, its RPN tokens,
+# 'program', the RPN compiled into a tree of closures, and its static
+# 'cost' (an ExpressionCost).  Call program(resolver) to evaluate.  It is
+# an immutable tuple, so one instance can be safely shared by any number
+# of threads and resolvers.
+class CompiledExpression(namedtuple("CompiledExpression", ["expression", "rpn", "program", "cost"])):
+   __slots__ = ()
+
+   # Allows conversion of object to string by Python natives
+   def __str__(self):
+      return (" ".join(self.rpn))
+
+# Thread-safe, bounded LRU cache of compiled expressions, keyed by the
+# expression string and the compiler's settings (a compiled expression
+# depends on the limits of the resolver which compiled it, see
+# DiceResolver.compile()).  The least recently used entry is evicted
+# when full.  Counters track hits, misses and evictions for monitoring.
+class ExpressionCache:
+   def __init__(self, maxsize=1024):
+      self.maxsize=maxsize
+      self.hits=0
+      self.misses=0
+      self.evictions=0
+      self.__entries=OrderedDict()
+      self.__lock=threading.Lock()
+
+   # Produced size of structure
+   def __len__(self):
+      return (len(self.__entries))
+
+   # Returns the compiled form of expression under 'settings' (any
+   # hashable value), building it with compiler(expression) on a miss.
+   # Compiling happens outside the lock, so a slow compile never blocks
+   # lookups from other threads.
+   def get(self, expression, compiler, settings=None):
+      key=(expression, settings)
+      with self.__lock:
+         compiled=self.__entries.get(key)
+         if (compiled is not None):
+            self.__entries.move_to_end(key)
+            self.hits+=1
+            return (compiled)
+         self.misses+=1
+
+      compiled=compiler(expression)
+
+      with self.__lock:
+         # Another thread may have beaten us to it; keep theirs
+         if (key in self.__entries):
+            self.__entries.move_to_end(key)
+            return (self.__entries[key])
+         self.__entries[key]=compiled
+         while (len(self.__entries) > self.maxsize):
+            self.__entries.popitem(last=False)
+            self.evictions+=1
+      return (compiled)
+
+   # Empties the cache; counters are kept.
+   def clear(self):
+      with self.__lock:
+         self.__entries.clear()
+
+   # Snapshot of the cache counters as a dictionary
+   def stats(self):
+      with self.__lock:
+         return ({"size": len(self.__entries), "maxsize": self.maxsize,
+                  "hits": self.hits, "misses": self.misses,
+                  "evictions": self.evictions})
 
 # The DiceResolver class is an infix expression resolver,
 # which handles order of operations (Using the Canadian BEDMAS rule
@@ -34,8 +594,45 @@ from datastructures import Stack, Queue
 
 # KSU 210816 Added getHistogram() which provides a heuristic analysis
 # of a particular dice roll.
+
+# Added getDistribution(), which computes the exact distribution of an
+# expression instead of estimating it by rolling.  Each RPN node becomes
+# a probability mass function and nodes are combined by convolution.
+# Only falls back to rolling when the outcome space gets too big.
+
+# Added a cache of compiled expressions.  resolve() compiles an expression
+# once, then only evaluates it, and no longer touches the 's' and 'q'
+# members, so several threads can share one resolver.  Pass a shared
+# ExpressionCache to let several resolvers reuse the same compilations.
+
+# Added resolveMany(), a batch mode which evaluates the RPN once over
+# NumPy arrays of n trials: each 'd' node draws an (n, N) matrix of dice
+# and sums its rows.  getHistogram() uses it when NumPy is installed.
+
+# getHistogram() can spread its trials over a pool of processes (see
+# 'workers'), with a reproducible random stream per batch of trials when
+# seeded.  The trial cap is now the configurable 'maxTrials' member.
+
+# Each resolver now owns its random streams instead of sharing the global
+# 'random' module: 'random' (a random.Random) for single rolls, and
+# 'generator' (a NumPy Generator) for batches.  Both come from one seed,
+# so a seeded resolver replays the same rolls; spawn() makes resolvers
+# with independent sub-streams for parallel workers.  'bitGenerator'
+# picks the NumPy algorithm ("PCG64", "PCG64DXSM", "Philox", "SFC64" or
+# "MT19937"), and 'rng' injects any random.Random compatible object
+# (which, unless a seed is also given, seeds the batch streams too).
+
+# Added dice modifiers, written straight after a roll:
+#   4d6kh3  keep the 3 highest dice (kh alone keeps 1)
+#   2d20kl  keep the lowest die (klN keeps N)
+#   2d6r1   reroll, once, any die showing 1 or less (r alone is r1)
+#   3d6x    exploding: a die showing its max rolls again and adds, up to
+#           'maxExplosions' times (xN explodes on N or more)
+# Explode is 'x' rather than '!', which already means factorial (3d6! is
+# the factorial of 3d6).  Modifiers work in every engine: single rolls,
+# batches, and exact distributions (keep uses order statistics).
 class DiceResolver:
-   def __init__(self):
+   def __init__(self, cache=None, seed=None, rng=None, bitGenerator="PCG64"):
       
       # BEDMAS ==> d()!^/%*+-
       # PEMDAS ==> d()!^*/%+-
@@ -62,71 +659,159 @@ class DiceResolver:
       self.q = Queue()
       self.error = False
 
-   # Converts a valid infix expression (mathematical expression)
-   # to postfix using Reverse Polish Notation (RPN). Infix exp-
-   # ression must be valid; this function can not check validi-
-   # ty.  Note that by design, this only supports integer expr-
-   # ession (no floating point support). FP support can be add-
-   # ed if while building numbers, the '.' character is accepted.
+      # Exact distributions give up (and estimate by rolling instead)
+      # once a single convolution would pair up more outcomes than this.
+      self.exactLimit = 1000000
+
+      # Number of trials used when an exact distribution falls back
+      # to a Monte Carlo estimate.
+      self.fallbackTrials = 100000
+
+      # Compiled expressions, keyed by expression string
+      self.cache = cache if cache is not None else ExpressionCache()
+
+      # The DiceError behind the last resolve() that returned 0
+      self.lastError = None
+
+      # Limits which bound evaluation time for untrusted expressions.
+      # Exceeding one raises DiceLimitError (resolve() returns 0).
+      self.maxFactorial = 1000
+      self.maxPowerBits = 4096
+
+      # Evaluation budget, checked against the static cost of a compiled
+      # expression before it is evaluated (see checkBudget()).
+      # budgetPolicy is "reject" or "cap" (clamp dice counts to maxDraws).
+      self.maxDraws = 100000
+      self.maxBits = 16384
+      self.budgetPolicy = "reject"
+
+      # Most extra rolls a single exploding die may add
+      self.maxExplosions = 100
+
+      # Random streams; see reseed().  'rng' is the injected generator,
+      # if any, which 'random' keeps using until reseeded with a seed.
+      # Without a seed, the batch streams are seeded from 'rng' too.
+      self.bitGenerator = bitGenerator
+      self.rng = rng if seed is None else None
+      self.reseed(seed)
+      if (rng is not None):
+         self.rng = rng
+         self.random = rng
+
+      # Largest dice matrix (in elements) drawn at once by the batch
+      # engine; bigger batches are rolled in blocks of rows.
+      self.blockSize = 1 << 22
+
+      # getHistogram() caps trials to this; raise it for long runs.
+      self.maxTrials = 1000000
+
+      # Trials are counted in batches of this size.  Each batch is one
+      # task (with its own random stream) in parallel/seeded histograms.
+      self.batchTrials = 1000000
+
+   # Splits an expression into Tokens in a single regex pass.  Raises
+   # DiceSyntaxError on any character that isn't part of the grammar.
+   def tokenize(self, expression):
+      position=0
+      length=len(expression)
+      while (position < length):
+         match=_TOKENS.match(expression, position)
+         if (not match):
+            raise DiceSyntaxError(f"Unexpected character '{expression[position]}'", expression, position)
+         if (match.lastgroup!="space"):
+            yield Token(match.lastgroup, match.group(), position)
+         position=match.end()
+
+   # Converts an infix expression (mathematical expression) to postfix
+   # using Reverse Polish Notation (RPN), with the shunting yard
+   # algorithm.  The expression is validated as it is parsed: operands
+   # and operators must alternate, and brackets must match, otherwise
+   # a DiceSyntaxError points at the offending token.  Note that by
+   # design, this only supports integer expression (no floating point
+   # support).
 
    # Example: Expression="1 + 2 * 3"  --> 7, NOT 9
    # RPN="1 2 3 * +"  --> 7
    # Note that the order of operations is preserved in the RPN.
-   def infixToRPN(self, expression):
-      
-      # Since a number may be multiple characters, we start with an empty string,
-      # and while each character is numeric, we append the number until a non-
-      # numeric value is encountered.
-      num = ""
-
-      # Tokenize expression character by character
-      for c in expression:
-         token=str(c)
-
-         # Case: we had accumulated a number but this character is not a
-         # numeric value; so save accumulated number, and reset accumulator.
-         if (num!="" and not token.isnumeric()):
-            self.q.enqueue(num)
-            num=""
-
-         # We aren't a number; so handle the token
+   def __toRPN(self, expression):
+      # 's' holds pending operator and '(' tokens, 'q' the output RPN
+      s=Stack()
+      q=Queue()
+
+      # True while the next token must start an operand (number or '(')
+      expectOperand=True
+
+      for token in self.tokenize(expression):
+         if (token.kind=="number"):
+            if (not expectOperand):
+               raise DiceSyntaxError("Expected an operator", expression, token.position)
+            q.enqueue(token.value)
+            expectOperand=False
+
          # '(' start brackets are simply markers of what point to return to when
          # a ')' close bracket is encountered.
-         if (token=="("):
-            self.s.push(token)
-
-         # Special case; we look for this first -> it means we have to pop all
-         # previous values off stack into the RPN queue until we find the '('
-         elif (token==")"):
-            # pop up until the bracket
-            while (self.s.peek()!="("):
-               self.q.enqueue(self.s.pop())
-
-            # pop the bracket / throw it away (it was just a marker, we're done with it)
-            self.s.pop()
-
-         # Casee: operator handling
-         # we are done handling brackets, check for a valid operator
-         elif (token in self.precedence):
-            while self.s.size() !=0 and (self.precedence[token] <= self.precedence[self.s.peek()]):
-               self.q.enqueue(self.s.pop())
-            self.s.push(token)
-
-         # Case: character is numeric.
-        # Append to accumulator and continue parsing
-         elif (token.isnumeric()):
-            num += token
-
-      # Did token end on a number? If so store accumulated number in RPN queue
-      if (num != ""):
-         self.q.enqueue(num)
+         elif (token.kind=="lparen"):
+            if (not expectOperand):
+               raise DiceSyntaxError("Expected an operator", expression, token.position)
+            s.push(token)
+
+         # Pop all previous operators off stack into the RPN queue until we
+         # find the '(', then throw the bracket away.
+         elif (token.kind=="rparen"):
+            if (expectOperand):
+               raise DiceSyntaxError("Expected a number or '('", expression, token.position)
+            while (s.size()!=0 and s.peek().kind!="lparen"):
+               q.enqueue(s.pop().value)
+            if (s.size()==0):
+               raise DiceSyntaxError("Unmatched ')'", expression, token.position)
+            s.pop()
+
+         # Dice modifiers must directly follow a roll's sides, while its
+         # 'd' is still on top of the stack; they are fused onto the 'd'.
+         elif (token.kind=="modifier"):
+            top=s.peek()
+            if (expectOperand or top is None or top.value[0]!="d"):
+               raise DiceSyntaxError(f"Modifier '{token.value}' must follow a dice roll, ie 4d6kh3", expression, token.position)
+            kind, count = _MODIFIER.match(token.value).groups()
+            if (kind[0] in [k[0] for k, n in _MODIFIER.findall(top.value, 1)]):
+               raise DiceSyntaxError(f"Duplicate modifier '{token.value}'", expression, token.position)
+            if (kind=="x" and count!="" and int(count)<1):
+               raise DiceSyntaxError("Explode threshold must be at least 1", expression, token.position)
+            s.pop()
+            s.push(Token(top.kind, top.value+token.value, top.position))
+
+         # Operator handling; '!' is postfix, so it completes an operand
+         else:
+            if (expectOperand):
+               raise DiceSyntaxError(f"Operator '{token.value}' is missing its left operand", expression, token.position)
+            while s.size() !=0 and (self.precedence[token.value] <= self.precedence[s.peek().value[0]]):
+               q.enqueue(s.pop().value)
+            s.push(token)
+            expectOperand = token.value!="!"
+
+      if (expectOperand):
+         if (q.size()==0 and s.size()==0):
+            raise DiceSyntaxError("Empty expression", expression, 0)
+         raise DiceSyntaxError("Unexpected end of expression", expression, len(expression))
 
       # Now pop items from stack to the queue to cleanup
-      while (self.s.size() != 0):
-         self.q.enqueue(self.s.pop())
-         
-      # At this point, we have a valid RPN in the 'q' queue
-      # (if the infix expression was valid)
+      while (s.size() != 0):
+         token=s.pop()
+         if (token.kind=="lparen"):
+            raise DiceSyntaxError("Unmatched '('", expression, token.position)
+         q.enqueue(token.value)
+
+      return (tuple(q))
+
+   # Public face of the converter.  Loads the RPN into the 'q' member
+   # (for use with evaluateRPN()) and returns a string version of it.
+   # Raises DiceSyntaxError if the expression is invalid.
+   def infixToRPN(self, expression):
+      self.q.clear()
+      self.s.clear()
+      for t in self.__toRPN(expression):
+         self.q.enqueue(t)
+
       # Let's return a string version:
       q_cp = self.q.copy()
 
@@ -135,39 +820,276 @@ class DiceResolver:
          rpn+=c+" "
       return (rpn)
 
+   # Compiles an expression into an immutable CompiledExpression,
+   # via the cache.  Safe to call from any thread.  Raises
+   # DiceSyntaxError if the expression is invalid.  The cost analysis
+   # and the optimizer depend on the limits in compileSettings(), so
+   # they are part of the cache key: resolvers with different limits
+   # (or one whose limits changed) never share a compilation.
+   def compile(self, expression):
+      return (self.cache.get(expression, self.__compile, self.compileSettings()))
+
+   # The limits which a compiled expression depends on: maxExplosions
+   # (its cost), maxBits (whether it is optimized), maxDraws (which dice
+   # merge) and maxFactorial and maxPowerBits (which constants fold).
+   def compileSettings(self):
+      return ((self.maxExplosions, self.maxBits, self.maxDraws, self.maxFactorial, self.maxPowerBits))
+
+   # The cost is analysed before optimizing, so an expression over
+   # budget is never folded (and its arithmetic never done) here.
+   def __compile(self, expression):
+      rpn=self.__toRPN(expression)
+      cost=self.__analyse(rpn)
+      if (cost.bits <= self.maxBits):
+         rpn=self.optimize(rpn)
+      return (CompiledExpression(expression, rpn, self.__build(rpn), cost))
+
+   # Static cost analysis of an expression; see __analyse().
+   def estimateCost(self, expression):
+      return (self.compile(expression).cost)
+
+   # Walks the RPN with a stack of (bound, draws), where 'bound' is an
+   # upper bound on the magnitude of that node's value, and 'draws' the
+   # most dice it can roll.  Operands are never negative (validation
+   # rejects them), so bounds only need to track magnitude.  Bounds and
+   # draws saturate at _COST_CEILING to keep the analysis itself cheap.
+   # Literals are measured in digits before int() parses them, so one
+   # too long for maxBits (or for Python's own int string limit) raises
+   # DiceLimitError rather than being converted.
+   def __analyse(self, rpn):
+      workstack=Stack()
+      widest=0
+      digits=int(self.maxBits*math.log10(2))+1
+      if (getattr(sys, "get_int_max_str_digits", None) and sys.get_int_max_str_digits()):
+         digits=min(digits, sys.get_int_max_str_digits())
+
+      for t in rpn:
+         if (t[0] in self.precedence):
+            right, rightdraws = workstack.pop()
+            if (t=="!"):
+               left, leftdraws = right, 0
+            else:
+               left, leftdraws = workstack.pop()
+            draws=leftdraws+rightdraws
+
+            if (t=="+"):
+               bound=left+right
+            elif (t=="-"):
+               bound=max(left, right)
+            elif (t=="*"):
+               bound=self.__saturate(left.bit_length()+right.bit_length(), lambda: left*right)
+            elif (t=="/"):
+               bound=left
+            elif (t=="%"):
+               bound=right
+            elif (t=="^"):
+               if (left<=1):
+                  bound=1
+               else:
+                  bound=self.__saturate(left.bit_length()*right, lambda: left**right)
+            elif (t=="!"):
+               # log2(n!) < n*log2(n)
+               bound=self.__saturate(left*left.bit_length(), lambda: 1 << (left*left.bit_length()))
+            elif (t=="C" or t=="c"):
+               # nCr <= 2^n
+               bound=self.__saturate(left, lambda: 1 << left)
+            else:
+               # 'd': at most left dice, each at most right.  Rerolls
+               # and explosions draw (and add) more per die.
+               modifiers=_diceModifiers(t)
+               perdie=1
+               if (modifiers is not None and modifiers.reroll is not None):
+                  perdie+=1
+               if (modifiers is not None and modifiers.explode is not None):
+                  perdie+=self.maxExplosions
+               bound=self.__saturate(left.bit_length()+right.bit_length()+perdie.bit_length(), lambda: left*right*perdie)
+               draws+=left*perdie
+
+            widest=max(widest, bound.bit_length())
+            workstack.push((bound, min(draws, _COST_CEILING)))
+         else:
+            if (len(t.lstrip("0")) > digits):
+               raise DiceLimitError(f"'{t[:20]}...' has {len(t):,} digits (limit {digits:,})")
+            value=int(t)
+            widest=max(widest, value.bit_length())
+            workstack.push((value, 0))
+
+      bound, draws = workstack.pop()
+      return (ExpressionCost(draws, widest))
+
+   # Computes a bound by fn(), unless its estimated bit length says it
+   # would be past the ceiling.
+   def __saturate(self, bits, fn):
+      if (bits > _COST_CEILING_BITS):
+         return (_COST_CEILING)
+      return (min(fn(), _COST_CEILING))
+
+   # Enforces the evaluation budget against a compiled expression's cost,
+   # raising DiceLimitError when it is over.  A result wider than maxBits
+   # is always rejected.  Too many dice are rejected, unless
+   # budgetPolicy is "cap", in which case each 'd' rolls at most maxDraws.
+   def checkBudget(self, compiled):
+      cost=compiled.cost
+      if (cost.bits > self.maxBits):
+         raise DiceLimitError(f"'{compiled.expression}' could produce a {cost.bits:,} bit value (limit {self.maxBits:,})")
+      if (cost.draws > self.maxDraws and self.budgetPolicy!="cap"):
+         raise DiceLimitError(f"'{compiled.expression}' could roll {cost.draws:,} dice (limit {self.maxDraws:,})")
+
+   # Compiles RPN into a tree of closures, so evaluation no longer copies
+   # a queue or re-inspects string tokens.  Integer literals are parsed
+   # here, once, and bound straight into their parent node.  A malformed
+   # RPN (an operator short of operands) compiles to a program that fails.
+   def __build(self, rpn):
+      # Closures nest one Python call per level of the expression; past
+      # _PROGRAM_DEPTH levels, run the iterative interpreter instead, so
+      # a long (but affordable) expression can't overflow the call stack.
+      if (self.__depth(rpn) > _PROGRAM_DEPTH):
+         return (self.__buildIterative(rpn))
+
+      # Each entry is (closure, literal value or None)
+      nodes=[]
+      for t in rpn:
+         if (t[0] in self.precedence):
+            if (not nodes):
+               return (_invalidProgram)
+            right=nodes.pop()
+
+            # Special case: ! only takes one argument
+            if (t=="!"):
+               nodes.append((self.__buildUnary(_OPERATIONS[t], right), None))
+               continue
+
+            if (not nodes):
+               return (_invalidProgram)
+            left=nodes.pop()
+            if (t in _OPERATIONS):
+               fn=_OPERATIONS[t]
+            else:
+               # Dice with modifiers
+               fn=lambda dice, left, right, modifiers=_diceModifiers(t): dice.roll(left, right, modifiers)
+            nodes.append((self.__buildBinary(fn, left, right), None))
+         else:
+            value=int(t)
+            nodes.append(((lambda dice, value=value: value), value))
+
+      # Empty expression
+      if (not nodes):
+         return (lambda dice: None)
+      return (nodes[-1][0])
+
+   # Nesting depth of an RPN's expression tree
+   def __depth(self, rpn):
+      depths=[]
+      deepest=0
+      for t in rpn:
+         if (t[0] in self.precedence):
+            if (not depths):
+               return (0)
+            depth=depths.pop()
+            if (t!="!"):
+               if (not depths):
+                  return (0)
+               depth=max(depth, depths.pop())
+            depths.append(depth+1)
+            deepest=max(deepest, depth+1)
+         else:
+            depths.append(0)
+      return (deepest)
+
+   # A program which evaluates the RPN with __evaluate(), whose stack is
+   # a Stack rather than the call stack.  Same results as the closures:
+   # its validation fails exactly where theirs would raise _InvalidOperand.
+   def __buildIterative(self, rpn):
+      def program(dice):
+         result, error = dice.__evaluate(rpn)
+         if (error):
+            raise _InvalidOperand()
+         return (result)
+      return (program)
+
+   # Operands are evaluated left then right, like the RPN, and rejected
+   # if negative.  Literals are never negative, so they skip the check.
+   def __buildBinary(self, fn, left, right):
+      leftfn, leftvalue = left
+      rightfn, rightvalue = right
+
+      if (leftvalue is not None and rightvalue is not None):
+         return (lambda dice: fn(dice, leftvalue, rightvalue))
 
-   # Routine to calculate a factorial
+      if (leftvalue is not None):
+         def node(dice):
+            r=rightfn(dice)
+            if (r<0):
+               raise _InvalidOperand()
+            return (fn(dice, leftvalue, r))
+         return (node)
+
+      if (rightvalue is not None):
+         def node(dice):
+            l=leftfn(dice)
+            if (l<0):
+               raise _InvalidOperand()
+            return (fn(dice, l, rightvalue))
+         return (node)
+
+      def node(dice):
+         l=leftfn(dice)
+         r=rightfn(dice)
+         if (l<0 or r<0):
+            raise _InvalidOperand()
+         return (fn(dice, l, r))
+      return (node)
+
+   def __buildUnary(self, fn, operand):
+      operandfn, value = operand
+      if (value is not None):
+         return (lambda dice: fn(dice, value, value))
+
+      def node(dice):
+         v=operandfn(dice)
+         if (v<0):
+            raise _InvalidOperand()
+         return (fn(dice, v, v))
+      return (node)
+
+
+   # Routine to calculate a factorial.  Raises DiceLimitError past
+   # 'maxFactorial', so user input like 5000! can't burn the CPU.
    def factorial(self, value):
       if (value<0):
          return (0)
-      elif (value==0 or value==1):
-         return (1)
-      elif (value==2):
-         return (2)
-
-      product=value;
-
-      for x in range(2, value):
-         product = product * x
-      return(product)
+      if (value > self.maxFactorial):
+         raise DiceLimitError(f"Factorial {value}! exceeds limit of {self.maxFactorial}!")
+      return (math.factorial(value))
 
 
    # Routine to calculate "choose" (combinatorics)
    # Formula:
    # nCr (n Choose r) = n! / r!(n-r)!
+   # Computed exactly in integers by math.comb(), which only needs
+   # min(r, n-r) steps; that step count is held to 'maxFactorial'.
    def choose(self, n, r):
-      numerator=self.factorial(n)
-      denominator=self.factorial(r)*self.factorial(n-r)
-
-      # Sanity
-      if (denominator==0):
+      # Sanity (the factorial of a negative was treated as 0)
+      if (n<0 or r<0 or r>n):
          return (0)
+      if (min(r, n-r) > self.maxFactorial):
+         raise DiceLimitError(f"{n}C{r} exceeds limit of {self.maxFactorial} steps")
+      return (math.comb(n, r))
 
-      # Compute
-      # NOTE: Should always be an integer result, but cast
-      # it anyways to be safe
-      return (int(numerator/denominator))
-         
+   # Integer division truncating towards zero, like int(left / right),
+   # but exact for integers too large for a float.
+   def divide(self, left, right):
+      quotient=abs(left) // abs(right)
+      if ((left<0) != (right<0)):
+         return (-quotient)
+      return (quotient)
+
+   # Exponent.  The size of the result is estimated before computing it,
+   # and rejected with DiceLimitError past 'maxPowerBits' bits.
+   def power(self, base, exponent):
+      if (exponent>0 and abs(base)>1 and (abs(base).bit_length()-1)*exponent > self.maxPowerBits):
+         raise DiceLimitError(f"{base}^{exponent} exceeds limit of {self.maxPowerBits} bits")
+      return (base**exponent)
 
    # Given left value, right value, and an operator, calculate.
    def calculate(self, left, right, op):   
@@ -181,10 +1103,10 @@ class DiceResolver:
          return (left * right)
 
       elif (op == "/"):
-         return (int(left / right))
+         return (self.divide(left, right))
 
       elif (op == "^"):
-         return (left**right)
+         return (self.power(left, right))
 
       elif (op == "%"):
          return (left % right)
@@ -199,33 +1121,69 @@ class DiceResolver:
       # NOTE: expressions without 'd' are deterministic;
       # expressions with 'd' are non-deterministic (variable
       # outcomes).
-      elif (op == "d"):
-         sum = 0;
-
-         # Left value is number of rolls; right value is die
-         # IE 3d6 = 3 rolls of a 6 sided die, summed.
-         for i in range(left):
-            sum+=random.randint(1, right);
-         return (sum);
+      elif (op[0] == "d"):
+         return (self.roll(left, right, _diceModifiers(op)))
 
       # whoops shouldn't have happened try to be graceful
       return (0);
 
+   # Rolls 'count' dice with 'sides' faces, and sums them.
+   # Left value is number of rolls; right value is die
+   # IE 3d6 = 3 rolls of a 6 sided die, summed.
+   # DiceModifiers apply per die first (reroll, then explode), and then
+   # keep picks which dice count towards the sum.
+   def roll(self, count, sides, modifiers=None):
+      if (count > self.maxDraws and self.budgetPolicy=="cap"):
+         count=self.maxDraws
+      if (sides<1 and count>0):
+         raise ValueError(f"Die must have at least one side: {count}d{sides}")
+      randint=self.random.randint
+
+      if (modifiers is None):
+         total = 0
+         for i in range(count):
+            total+=randint(1, sides)
+         return (total)
+
+      threshold=modifiers.explode if modifiers.explode else sides
+      dice=[]
+      for i in range(count):
+         value=randint(1, sides)
+         if (modifiers.reroll is not None and value<=modifiers.reroll):
+            value=randint(1, sides)
+         if (modifiers.explode is not None):
+            last=value
+            explosions=0
+            while (last>=threshold and explosions<self.maxExplosions):
+               last=randint(1, sides)
+               value+=last
+               explosions+=1
+         dice.append(value)
+
+      if (modifiers.keep is None):
+         return (sum(dice))
+      if (modifiers.keep<=0):
+         return (0)
+      dice.sort()
+      if (modifiers.highest):
+         return (sum(dice[-modifiers.keep:]))
+      return (sum(dice[:modifiers.keep]))
+
 
    # Nifty little stack and queue algorithm for evaluating
-   # the RPN.  Expects a valid RPN expression.
-   def evaluateRPN(self):
+   # the RPN.  Expects a valid RPN expression.  Returns a tuple of
+   # (result, error).  Uses only local state, so it is thread-safe.
+   def __evaluate(self, rpn):
       workstack=Stack()
 
       # As we pull tokens from the queue, we validate them and if neither a number
       # nor an operator, we abort with an error.
-      for t in self.q.copy():
-         if (t in self.precedence):
+      for t in rpn:
+         if (t[0] in self.precedence):
             # As we work backwards, right value is first; validate
             right=workstack.pop()
             if (not str(right).isnumeric() and not right in self.precedence):
-                self.error=True
-                break
+                return ((0, True))
 
             # Now get left value, validate
             # Special case: ! only takes one argument. Make them identical
@@ -234,8 +1192,7 @@ class DiceResolver:
             else:
                left=workstack.pop()
                if (not str(left).isnumeric() and not left in self.precedence):
-                   self.error=True
-                   break
+                   return ((0, True))
 
             # Both valid, so calculate
             workstack.push(self.calculate(left, right, t))
@@ -243,36 +1200,507 @@ class DiceResolver:
             workstack.push(int(t))
 
       # answer is now on the stack
+      return ((workstack.pop(), False))
+
+   # Evaluates the RPN held in the 'q' member (see infixToRPN()).
+   def evaluateRPN(self):
+      result, error = self.__evaluate(self.q.copy())
+      if (error):
+         self.error=True
       if (not self.error):
-         return (workstack.pop())
+         return (result)
       else:
          return (0)
 
+   # Evaluates a CompiledExpression (see compile()) by running its
+   # closure program.  Invalid expressions resolve to 0, and so do those
+   # over a limit (DiceLimitError) or which can't be computed, such as
+   # "1/0", "1%0" or "1d0"; the exception is kept in 'lastError'.
+   # NOTE: When threads share a resolver, 'error' reflects whichever
+   # evaluation finished last.
+   def evaluate(self, compiled):
+      try:
+         self.checkBudget(compiled)
+         result=compiled.program(self)
+      except _InvalidOperand:
+         self.error=True
+         self.lastError=None
+         return (0)
+      except (ArithmeticError, ValueError) as e:
+         self.error=True
+         self.lastError=e
+         return (0)
+      self.error=False
+      return (result)
 
    # One function to handle it all. How Pythonic.
+   # The compiled expression comes from the cache, so after the first call
+   # only evaluation is done.  'repeat' is kept for compatibility; it used
+   # to skip rebuilding the RPN, which the cache now always does.
    def resolve(self, expression, repeat=False):
-      if not repeat:
-         self.error=False
-         self.q.clear()
-         self.s.clear()
-         self.infixToRPN(expression)
-         return (self.evaluateRPN())
+      try:
+         compiled=self.compile(expression)
+      except DiceError as e:
+         self.error=True
+         self.lastError=e
+         return (0)
+      return (self.evaluate(compiled))
+
+   # Resolves a list of expressions (ie a character sheet) in one call,
+   # returning their results in input order.  Each distinct expression
+   # is looked up in the cache (where it was folded, see optimize(),
+   # when it was compiled) once per batch, and one that folds to a
+   # constant is evaluated only once.  Nothing else is shared between
+   # expressions.  Repeated dice expressions still roll independently.
+   # Invalid expressions resolve to 0, and 'error' is set if any entry
+   # failed.
+   def resolveBatch(self, expressions):
+      prepared={}
+      results=[]
+      failed=False
+
+      for expression in expressions:
+         if (expression not in prepared):
+            prepared[expression]=self.__prepareBatch(expression)
+         value, compiled = prepared[expression]
+
+         if (compiled is None):
+            results.append(value)
+            failed = failed or value is None
+         else:
+            results.append(self.evaluate(compiled))
+            failed = failed or self.error
+
+      self.error=failed
+      return ([0 if value is None else value for value in results])
+
+   # Returns (value, None) for an expression with a fixed value, (None,
+   # None) for an invalid one, or (None, compiled) for one with dice.
+   def __prepareBatch(self, expression):
+      try:
+         compiled=self.compile(expression)
+      except DiceError as e:
+         self.lastError=e
+         return ((None, None))
+
+      if (len(compiled.rpn)==1):
+         return ((int(compiled.rpn[0]), None))
+      return ((None, compiled))
+
+   # Optimization pass over a valid RPN, run by compile(): deterministic
+   # subtrees are folded to constants (see foldConstants()), then like
+   # dice terms are merged (see mergeDice()).  The result has the same
+   # distribution as the original, so only the random parts are left to
+   # evaluate per trial.
+   def optimize(self, rpn):
+      return (self.mergeDice(self.foldConstants(rpn)))
+
+   # Replaces every deterministic subtree of the RPN (one without dice)
+   # by its value, ie "12 2 3 ^ + 10 /" becomes "2".  Subtrees which
+   # fail (or go negative, which the validation of their parent must
+   # still see) are left as they are.  Folding happens once per compiled
+   # expression, so the cache is what shares it between calls.
+   def foldConstants(self, rpn):
+      # Each entry is (tokens of the subtree, foldable)
+      workstack=Stack()
+      for t in rpn:
+         if (t[0] not in self.precedence):
+            workstack.push(((t,), True))
+            continue
+
+         right, rightfoldable = workstack.pop()
+         if (t=="!"):
+            left, leftfoldable = (), True
+         else:
+            left, leftfoldable = workstack.pop()
+         subtree=left+right+(t,)
+
+         if (t[0]=="d" or not (leftfoldable and rightfoldable)):
+            workstack.push((subtree, False))
+            continue
+
+         value=self.__foldValue(subtree)
+         if (value is None):
+            workstack.push((subtree, False))
+         else:
+            workstack.push(((value,), True))
+
+      return (workstack.pop()[0])
+
+   # Value of a deterministic subtree as an RPN literal, or None
+   def __foldValue(self, subtree):
+      try:
+         value, error = self.__evaluate(subtree)
+         if (error or value<0):
+            return (None)
+         return (str(value))
+      except (DiceError, ArithmeticError, ValueError):
+         return (None)
+
+   # Flattens every chain of '+' into its terms, and merges like terms:
+   # literal dice with the same sides and modifiers (1d6+1d6 --> 2d6, or
+   # 1d6x+2d6x --> 3d6x), and constants (1d6+3+2 --> 1d6 5 +).  Rolls
+   # that keep dice are never merged (2d20kh1 is not 1d20kh1+1d20kh1),
+   # nor any that would then roll more than maxDraws dice.  Operands are
+   # never negative, so reordering a sum can't change whether it fails.
+   def mergeDice(self, rpn):
+      # Each entry is the list of terms (token tuples) summed by a subtree
+      workstack=Stack()
+      for t in rpn:
+         if (t[0] not in self.precedence):
+            workstack.push([(t,)])
+            continue
+
+         right=workstack.pop()
+         if (t=="!"):
+            workstack.push([self.__joinTerms(right)+(t,)])
+            continue
+
+         left=workstack.pop()
+         if (t=="+"):
+            workstack.push(left+right)
+         else:
+            workstack.push([self.__joinTerms(left)+self.__joinTerms(right)+(t,)])
+
+      return (self.__joinTerms(workstack.pop()))
+
+   # Sums a list of terms back into RPN, merging like terms.  Each merged
+   # term takes the place of the first term it absorbed.
+   def __joinTerms(self, terms):
+      if (len(terms)==1):
+         return (terms[0])
+
+      # Key of each term: the dice operator and sides, "" for a
+      # constant, or None if it can't be merged
+      keys=[]
+      totals=dict()
+      for term in terms:
+         key=None
+         if (len(term)==1):
+            key=""
+         elif (len(term)==3 and term[2][0]=="d" and term[0].isdigit() and term[1].isdigit()):
+            modifiers=_diceModifiers(term[2])
+            if (modifiers is None or modifiers.keep is None):
+               key=(term[2], term[1])
+         keys.append(key)
+         if (key is not None):
+            totals[key]=totals.get(key, 0) + int(term[-3 if key else 0])
+
+      merged=[]
+      for term, key in zip(terms, keys):
+         if (key is None or (key and totals.get(key, 0) > self.maxDraws)):
+            merged.append(term)
+         elif (key in totals):
+            if (key):
+               merged.append((str(totals.pop(key)), key[1], key[0]))
+            else:
+               merged.append((str(totals.pop(key)),))
+
+      rpn=merged[0]
+      for term in merged[1:]:
+         rpn+=term+("+",)
+      return (rpn)
+
+   # Batch mode: resolves an expression n times in one pass.  Returns a
+   # NumPy array of n results (or a list when NumPy is not installed).
+   # Trials that fail validation (see evaluateRPN()) resolve to 0, just
+   # as they would one at a time.  The batch engine works in int64, so
+   # an expression whose cost says a value could be wider than that is
+   # evaluated one trial at a time instead, into an array of Python ints.
+   def resolveMany(self, expression, n):
+      compiled=self.compile(expression)
+      self.checkBudget(compiled)
+      if (np is None):
+         return ([self.evaluate(compiled) for i in range(n)])
+
+      if (compiled.cost.bits > _BATCH_BITS):
+         results=np.empty(n, dtype=object)
+         failed=n > 0
+         for i in range(n):
+            results[i]=self.evaluate(compiled)
+            failed = failed and self.error
+         self.error=failed
+         return (results)
+
+      result, error = self.__evaluateMany(compiled.rpn, n)
+      self.error=error
+      return (result)
+
+   # Same algorithm as __evaluate(), but each stack entry is a plain int
+   # (a constant) or an array holding one value per trial.  'bad' marks
+   # trials that tripped the validation, which only rejects negative
+   # operands once the RPN itself is well formed.
+   def __evaluateMany(self, rpn, n):
+      workstack=Stack()
+      bad=False
+
+      for t in rpn:
+         if (t[0] in self.precedence):
+            right=workstack.pop()
+            if (t=="!"):
+               left=right
+            else:
+               left=workstack.pop()
+            if (left is None or right is None):
+               return ((np.zeros(n, dtype=np.int64), True))
+
+            bad = bad | (np.asarray(left) < 0) | (np.asarray(right) < 0)
+            result, bad = self.__calculateMany(left, right, t, bad, n)
+            workstack.push(result)
+         else:
+            workstack.push(int(t))
+
+      result=workstack.pop()
+      if (workstack.size()!=0):
+         return ((np.zeros(n, dtype=np.int64), True))
+
+      result=np.broadcast_to(result, (n,)).copy()
+      bad=np.broadcast_to(bad, (n,))
+      if (bad.any()):
+         result[bad]=0
+      return ((result, bool(bad.all())))
+
+   # Elementwise calculate() over arrays of trials.  Returns the result
+   # and 'bad', with the trials that can't be computed (ie a division by
+   # zero) added; those are given a harmless operand instead, so the
+   # rest of the batch is unaffected, and resolve to 0 later.
+   def __calculateMany(self, left, right, op, bad, n):
+      if (op == "+"):
+         return ((left + right, bad))
+
+      elif (op == "-"):
+         return ((left - right, bad))
+
+      elif (op == "*"):
+         return ((left * right, bad))
+
+      elif (op == "/" or op == "%"):
+         zero = np.asarray(right)==0
+         if (np.any(zero & ~np.asarray(bad))):
+            self.lastError=ZeroDivisionError("division by zero" if op=="/" else "integer modulo by zero")
+         bad = bad | zero
+         right=np.where(zero, 1, right)
+         if (op == "%"):
+            return ((np.mod(left, right), bad))
+         # Truncates towards zero, like int(left / right)
+         quotient=np.abs(left) // np.abs(right)
+         return ((np.where((np.asarray(left) < 0) != (np.asarray(right) < 0), -quotient, quotient), bad))
+
+      elif (op[0] == "d"):
+         # A die needs at least one side, if any are rolled
+         sideless = (np.asarray(left) > 0) & (np.asarray(right) < 1)
+         if (np.any(sideless & ~np.asarray(bad))):
+            self.lastError=ValueError("Die must have at least one side")
+         bad = bad | sideless
+         # Invalid trials are zeroed later; keep them from upsetting the draw
+         count=np.where(bad, 0, left)
+         sides=np.where(bad, 1, right)
+         return ((self.__rollMany(count, sides, n, _diceModifiers(op)), bad))
+
+      # Anything else (^, !, C) is done per trial with exact Python
+      # integers, then packed back down to int64 if it fits.
+      fn=np.frompyfunc(lambda a, b: self.__calculateTrial(int(a), int(b), op), 2, 1)
+      result=np.asarray(fn(np.where(bad, 0, left), np.where(bad, 0, right)))
+      failed=np.asarray(np.frompyfunc(lambda value: value is _INVALID, 1, 1)(result), dtype=bool)
+      if (failed.any()):
+         bad = bad | failed
+         result=np.where(failed, 0, result)
+      try:
+         return ((result.astype(np.int64), bad))
+      except (OverflowError, AttributeError):
+         return ((result, bad))
+
+   # calculate() for one trial of the batch engine; _INVALID if it can't
+   # be computed (or is over a limit), which evaluate() would resolve to 0
+   def __calculateTrial(self, left, right, op):
+      try:
+         return (self.calculate(left, right, op))
+      except (ArithmeticError, ValueError) as e:
+         self.lastError=e
+         return (_INVALID)
+
+   # Rolls count[i] dice with sides[i] faces for every trial i, and sums
+   # each trial.  Draws an (n, max count) matrix in blocks of rows, with
+   # surplus dice masked out when the count varies between trials.
+   # Modifiers work on the whole matrix: rerolls and explosions redraw
+   # only the dice that need it, and keep sorts each row.
+   def __rollMany(self, count, sides, n, modifiers=None):
+      if (self.budgetPolicy=="cap"):
+         count=np.minimum(count, self.maxDraws)
+      count=np.broadcast_to(count, (n,))
+      sides=np.broadcast_to(sides, (n,))
+      width=int(count.max()) if n > 0 else 0
+      total=np.zeros(n, dtype=np.int64)
+      if (width<=0):
+         return (total)
+
+      rows=max(1, self.blockSize // width)
+      varies = count.min() != width
+      for start in range(0, n, rows):
+         stop=min(n, start+rows)
+         high=sides[start:stop, None] + 1
+         draws=self.generator.integers(1, high, size=(stop-start, width))
+         if (modifiers is not None):
+            draws=self.__modifyMany(draws, high, modifiers)
+         unused = np.arange(width) >= count[start:stop, None] if varies else None
+
+         if (modifiers is None or modifiers.keep is None):
+            if (varies):
+               draws[unused] = 0
+            total[start:stop]=draws.sum(axis=1)
+            continue
+
+         # Keep: unused dice sort to the end which is never kept, or
+         # are zero when fewer dice were rolled than are kept
+         k=min(modifiers.keep, width)
+         if (varies):
+            draws[unused] = 0 if modifiers.highest else np.iinfo(np.int64).max
+         draws.sort(axis=1)
+         kept = draws[:, width-k:] if modifiers.highest else draws[:, :k]
+         if (varies and not modifiers.highest):
+            kept = np.where(kept==np.iinfo(np.int64).max, 0, kept)
+         total[start:stop]=kept.sum(axis=1)
+      return (total)
+
+   # Applies rerolls, then explosions, to a matrix of dice draws
+   def __modifyMany(self, draws, high, modifiers):
+      high=np.broadcast_to(high, draws.shape)
+
+      if (modifiers.reroll is not None):
+         reroll = draws<=modifiers.reroll
+         draws[reroll]=self.generator.integers(1, high[reroll])
+
+      if (modifiers.explode is not None):
+         threshold = modifiers.explode if modifiers.explode else high-1
+         last=draws
+         for i in range(self.maxExplosions):
+            exploding = last>=threshold
+            if (not exploding.any()):
+               break
+            last=np.zeros_like(draws)
+            last[exploding]=self.generator.integers(1, high[exploding])
+            draws=draws+last
+      return (draws)
+
+   # Rolls an expression 'trials' times, and returns a dictionary
+   # of outcome -> number of times rolled.
+   def countRolls(self, expression, trials):
+      rolls=dict()
+
+      if (np is not None):
+         # Roll each batch of trials at once, then count the outcomes
+         for start in range(0, trials, self.batchTrials):
+            batch=self.resolveMany(expression, min(self.batchTrials, trials-start))
+            values, counts = np.unique(batch, return_counts=True)
+            for value, count in zip(values.tolist(), counts.tolist()):
+               rolls[value] = rolls.get(value, 0) + count
+      else:
+         compiled=self.compile(expression)
+         self.checkBudget(compiled)
+         for i in range(trials):
+            roll=self.evaluate(compiled)
+            rolls[roll] = rolls.get(roll, 0) + 1
+
+      return (rolls)
+
+   # Splits the trials into batches, each rolled by _countRollsWorker()
+   # with its own random stream, and merges their counts.  Streams are
+   # spawned per batch (not per process), so a given seed reproduces the
+   # same histogram whatever the number of workers.  Without a seed,
+   # streams are spawned from the resolver's own.  With workers<=1 the
+   # batches are rolled in this process.
+   def __countRollsParallel(self, expression, trials, workers, seed):
+      chunks=[self.batchTrials] * (trials // self.batchTrials)
+      if (trials % self.batchTrials):
+         chunks.append(trials % self.batchTrials)
+
+      seeds=self.spawnSeeds(len(chunks), seed)
+      expressions=[expression] * len(chunks)
+      bitGenerators=[self.bitGenerator] * len(chunks)
+      limits=[tuple(getattr(self, name) for name in _WORKER_LIMITS)] * len(chunks)
+      rolls=dict()
+      if (workers<=1):
+         results=map(_countRollsWorker, expressions, chunks, seeds, bitGenerators, limits)
+         for counts in results:
+            for value, count in counts.items():
+               rolls[value] = rolls.get(value, 0) + count
       else:
-         # Repeat=True
-         # This allows repeat dice rolls / calculations, without rebuilding
-         # the RPN queue each time.
-         return (self.evaluateRPN())
+         with ProcessPoolExecutor(max_workers=workers) as pool:
+            for counts in pool.map(_countRollsWorker, expressions, chunks, seeds, bitGenerators, limits):
+               for value, count in counts.items():
+                  rolls[value] = rolls.get(value, 0) + count
+      return (rolls)
+
+   # Seeds (or reseeds) the random streams.  'seed' may be None (fresh
+   # entropy), an integer, or a NumPy SeedSequence.  With NumPy, one
+   # SeedSequence feeds both 'generator' and, through its own child key,
+   # 'random'; without NumPy only 'random' exists.  A generator injected
+   # as 'rng' is kept as 'random' when no seed is given, and seeds the
+   # SeedSequence, so batches (and spawn()) replay along with the single
+   # rolls; an explicit seed replaces it (and drops it) so the rolls
+   # replay from that seed.
+   def reseed(self, seed=None):
+      if (seed is not None):
+         self.rng=None
+
+      if (np is None):
+         self.seedSequence=None
+         self.generator=None
+         self.random = self.rng if self.rng is not None else random.Random(seed)
+         return
+
+      if (seed is None and self.rng is not None):
+         seed=self.rng.getrandbits(128)
+      if (isinstance(seed, np.random.SeedSequence)):
+         self.seedSequence=seed
+      else:
+         self.seedSequence=np.random.SeedSequence(seed)
+      bits=getattr(np.random, self.bitGenerator)(self.seedSequence)
+      self.generator=np.random.Generator(bits)
+
+      # A key which spawn() never hands out, so this stream is distinct
+      if (self.rng is not None):
+         self.random=self.rng
+         return
+      seeds=np.random.SeedSequence(self.seedSequence.entropy,
+                                   spawn_key=self.seedSequence.spawn_key + (0xD1CE,))
+      self.random=random.Random(int.from_bytes(seeds.generate_state(8).tobytes(), "little"))
+
+   # Seeds for n independent sub-streams.  Drawn from 'seed' when given,
+   # otherwise from this resolver's own streams, so a seeded resolver
+   # always hands out the same sequence of sub-streams.
+   def spawnSeeds(self, n, seed=None):
+      if (np is not None):
+         if (seed is not None):
+            return (np.random.SeedSequence(seed).spawn(n))
+         return (self.seedSequence.spawn(n))
+
+      rng = random.Random(seed) if seed is not None else self.random
+      return ([rng.getrandbits(128) for i in range(n)])
+
+   # Creates n resolvers with independent random sub-streams (sharing
+   # this resolver's cache), ie one per worker thread.
+   def spawn(self, n):
+      return ([DiceResolver(self.cache, seed, bitGenerator=self.bitGenerator) for seed in self.spawnSeeds(n)])
+
+   # Creates an empty, incremental Histogram for an expression.  The
+   # expression is compiled (and so validated) right away.
+   def histogram(self, expression):
+      self.compile(expression)
+      return (Histogram(self, expression))
 
    # Heuristic to calculate expression distribution, ment to be
    # used with dice rolls (ie, 2d6).  This is done by repeating rolls
-   # to a cap of n trials, then assessing the results.
+   # to a cap of n trials (see maxTrials), then assessing the results.
+   # Set 'workers' to spread the trials over that many processes (0 uses
+   # every core), and 'seed' for a reproducible histogram.
    # Returns a histogram report with trial results, mean and mode.
-   def getHistogram(self, expression, trials):
+   def getHistogram(self, expression, trials, workers=None, seed=None):
       # Validate min/max boundaries
       if (trials<0):
          trials = 1
-      elif (trials > 1000000):
-         trials=1000000
+      elif (trials > self.maxTrials):
+         trials=self.maxTrials
 
       # Initialize
       sb = ""
@@ -283,19 +1711,14 @@ class DiceResolver:
       result=dict()
 
       # Build
-      for i in range(trials):
-         if i==0:
-            roll=self.resolve(expression);
-         else:
-            # We already built the RPN, don't waste cycles
-            # reuilding it on every iteration, set repeat=True.
-            roll=self.resolve(expression, repeat=True)
-
-         # Track the recurrences of roll values
-         if (roll in rolls.keys()):
-            rolls[roll] += 1
-         else:
-            rolls[roll]= 1
+      if (workers is None and seed is None):
+         rolls=self.countRolls(expression, trials)
+      else:
+         if (workers is None):
+            workers=1
+         elif (workers==0):
+            workers=os.cpu_count() or 1
+         rolls=self.__countRollsParallel(expression, trials, workers, seed)
 
       # Nifty way to build a key sorted report
       keys = list(rolls.keys())
@@ -335,8 +1758,122 @@ class DiceResolver:
                         
       # Send back the report
       return (sb+pic)
+
+   # Exact probability distribution of an expression.  Walks the RPN
+   # like evaluateRPN(), but every stack entry is a Distribution
+   # instead of a number.  Dice nodes become the convolution of their
+   # faces; other operators combine every pair of outcomes.  If the
+   # outcome space explodes (see exactLimit), falls back to estimating
+   # the distribution by rolling 'fallbackTrials' times.  The work of a
+   # dice node is estimated before it is built (see
+   # Distribution.diceCost()), so an exploding or rerolling roll that is
+   # over budget falls back right away.
+   def getDistribution(self, expression):
+      compiled=self.compile(expression)
+      self.checkBudget(compiled)
+      self.error=False
+
+      try:
+         return (self.__exactDistribution(compiled.rpn))
+      except OverflowError:
+         counts=self.countRolls(expression, self.fallbackTrials)
+         return (Distribution(counts, self.fallbackTrials, exact=False))
+
+   # Cheap operators are convolved directly; anything else goes
+   # through calculate() for identical semantics.  Outcomes which would
+   # fail validation (a negative operand) become _INVALID, and so 0 in
+   # the result, exactly as evaluate() resolves such a trial.  'error' is
+   # set if every outcome is invalid, as with resolveMany().
+   def __exactDistribution(self, rpn):
+      direct = {"+": operator.add, "-": operator.sub, "*": operator.mul}
+      workstack=Stack()
+
+      for t in rpn:
+         if (t[0] in self.precedence):
+            right=workstack.pop()
+            if (t=="!"):
+               left=right
+            else:
+               left=workstack.pop()
+            if (left is None or right is None):
+               self.error=True
+               return (Distribution.constant(0))
+
+            if (t[0]=="d"):
+               modifiers=_diceModifiers(t)
+               parts=[]
+               for n, cn in left.counts.items():
+                  for m, cm in right.counts.items():
+                     if (self.__invalidOperands(n, m)):
+                        parts.append((cn*cm, Distribution.constant(_INVALID)))
+                        continue
+                     try:
+                        parts.append((cn*cm, Distribution.dice(n, m, self.exactLimit, modifiers, self.maxExplosions)))
+                     except OverflowError:
+                        raise
+                     except (ArithmeticError, ValueError) as e:
+                        self.lastError=e
+                        parts.append((cn*cm, Distribution.constant(_INVALID)))
+               workstack.push(Distribution.mix(parts))
+            elif (t=="!"):
+               workstack.push(right.map(self.__exactOperation(lambda a, b: self.factorial(a))))
+            elif (t in direct):
+               workstack.push(left.combine(right, self.__exactOperation(direct[t]), self.exactLimit))
+            else:
+               fn = lambda a, b, op=t: self.calculate(a, b, op)
+               workstack.push(left.combine(right, self.__exactOperation(fn), self.exactLimit))
+         else:
+            workstack.push(Distribution.constant(int(t)))
+
+      if (workstack.size()!=1):
+         self.error=True
+         return (Distribution.constant(0))
+
+      result=workstack.pop()
+      if (_INVALID in result.counts):
+         self.error = len(result.counts)==1
+         result=result.map(lambda value: 0 if value is _INVALID else value)
+      return (result)
+
+   # True if an outcome's operands fail validation (or already failed)
+   def __invalidOperands(self, left, right):
+      return (left is _INVALID or right is _INVALID or left<0 or right<0)
+
+   # Wraps an operation on two outcomes with the validation of its
+   # operands; map() passes a single outcome, which is used for both.
+   # Outcomes which can't be computed (ie a division by zero) are
+   # invalid too.  OverflowError still means the space is too big.
+   def __exactOperation(self, fn):
+      def operation(left, right=None):
+         if (right is None):
+            right=left
+         if (self.__invalidOperands(left, right)):
+            return (_INVALID)
+         try:
+            return (fn(left, right))
+         except OverflowError:
+            raise
+         except (ArithmeticError, ValueError) as e:
+            self.lastError=e
+            return (_INVALID)
+      return (operation)
   
 
+# Limits of the calling resolver which a parallel histogram's workers
+# apply too, in this order; see _countRollsWorker().
+_WORKER_LIMITS = ("maxDraws", "maxBits", "budgetPolicy", "maxExplosions", "maxFactorial", "maxPowerBits")
+
+# Rolls one batch of trials for a parallel histogram.  Lives at module
+# level so a process pool can pickle it.  Each batch gets a fresh
+# resolver whose random streams come from 'seed', with the caller's
+# 'limits' (values for _WORKER_LIMITS).
+def _countRollsWorker(expression, trials, seed, bitGenerator, limits):
+   dice=DiceResolver(seed=seed, bitGenerator=bitGenerator)
+   for name, value in zip(_WORKER_LIMITS, limits):
+      setattr(dice, name, value)
+   return (dice.countRolls(expression, trials))
+
+
 # Integrated, interactive testing of module.
 # Run module to access this function.
 def test():
@@ -348,12 +1885,164 @@ def test():
          break
       if (x!=""):
          p=x
-      print("RPN:    ",dice.infixToRPN(p))
+      try:
+         print("RPN:    ",dice.infixToRPN(p))
+         print("OPT:    ",dice.compile(p))
+      except DiceSyntaxError as e:
+         print(e.toString())
+         continue
       print("ANSWER: ",dice.resolve(p))
       print(dice.getHistogram(p, 50000))
+      print(dice.getDistribution(p))
    return
 
-# Interactive testing
+# Non-interactive checks that the engines agree ('python dice.py check').
+# Each prints a line; returns the number of checks that failed.
+def check():
+   failures=0
+
+   def report(label, ok):
+      nonlocal failures
+      print(f"{label:60} {'ok' if ok else 'FAILED'}")
+      if (not ok):
+         failures+=1
+
+   # Expressions which go negative: an operand below zero makes that
+   # outcome 0, in resolve(), resolveMany() and getDistribution() alike
+   dice=DiceResolver(seed=1)
+   trials=20000
+   for expression in ["(1-3)*2", "(1d4-3)*2", "(1d6-1d6)*1d4", "(1d4-2)d6", "(1d4-3)!", "2^(1d3-2)",
+                      "12/(1d3-1)", "7%(1d3-1)", "1d(1d3-1)", "(1d4+2)!"]:
+      exact=dice.getDistribution(expression)
+      single=[dice.resolve(expression) for i in range(trials)]
+      if (np is not None):
+         batch=dice.resolveMany(expression, trials).tolist()
+      else:
+         batch=single
+      ok=set(single)<=set(exact.counts) and set(batch)<=set(exact.counts)
+      for value in exact.counts:
+         p=exact.probability(value)
+         ok = ok and abs(single.count(value)/trials-p) < 0.02 and abs(batch.count(value)/trials-p) < 0.02
+      report(f"Engines agree on '{expression}'", ok)
+
+   # A cache shared by resolvers with different limits keeps a
+   # compilation for each, so neither sees the other's cost or folding
+   strict=DiceResolver(cache=dice.cache)
+   strict.maxExplosions=1
+   strict.maxFactorial=5
+   loose=dice.estimateCost("1d6x").draws
+   report("Cost follows each resolver's maxExplosions", strict.estimateCost("1d6x").draws < loose)
+   dice.resolve("6!+1d6")
+   strict.resolve("6!+1d6")
+   report("A constant folded under one limit is refused under another", strict.error and not dice.error)
+
+   # reseed() keeps an injected generator, unless given a seed
+   injected=random.Random(7)
+   seeded=DiceResolver(rng=injected)
+   seeded.reseed()
+   kept = seeded.random is injected
+   seeded.reseed(42)
+   report("reseed() keeps an injected rng unless given a seed", kept and seeded.random is not injected)
+   if (np is not None):
+      first=DiceResolver(rng=random.Random(7))
+      second=DiceResolver(rng=random.Random(7))
+      same=list(first.resolveMany("3d6", 50))==list(second.resolveMany("3d6", 50))
+      report("An injected rng also seeds the batch streams", same and first.countRolls("1d20", 200)==second.countRolls("1d20", 200))
+
+   # Arithmetic that can't be done resolves to 0 in every engine, with
+   # the reason kept in lastError, and never raises
+   for expression in ["1/0", "1%0", "1d0", "1d6/(1d1-1)", "7!"]:
+      try:
+         dice.maxFactorial=6
+         ok = dice.resolve(expression)==0 and dice.error and dice.lastError is not None
+         ok = ok and set(np.asarray(dice.resolveMany(expression, 100)).tolist() if np is not None else [0])=={0}
+         ok = ok and dice.getDistribution(expression).probabilities()=={0: 1.0} and dice.error
+      except (ArithmeticError, ValueError):
+         ok=False
+      finally:
+         dice.maxFactorial=1000
+      report(f"'{expression}' resolves to 0 in every engine", ok)
+   dice.resolve("1/0")
+   dice.resolve("(1-2)*3")
+   report("An invalid operand clears lastError", dice.error and dice.lastError is None)
+
+   # Exploding and rerolling dice over the exact budget are sampled at
+   # once, without first convolving up to the limit
+   timer=Timer()
+   ok=True
+   for expression in ["3d6r2x5kh2", "8d10x", "50d100kh10"]:
+      timer.start()
+      ok = ok and not dice.getDistribution(expression).exact and timer.elapsed("s") < 1.0
+   report("Over budget dice fall back to sampling straight away", ok and dice.getDistribution("1d20x").exact)
+
+   # An expression deeper than the call stack still resolves
+   deep=DiceResolver(seed=1)
+   value=deep.resolve("1d2*"*1000+"1")
+   ok = not deep.error and 1 <= value <= 2**1000
+   value=deep.resolve("(1-2)*"+"1d2*"*1000+"1")
+   report("Deeply nested expressions resolve without recursion", ok and value==0 and deep.error)
+
+   # Results wider than int64 must not wrap in the batch engine
+   big=dice.resolveMany("1d6*2^70", 1000).tolist()
+   report("resolveMany() keeps results wider than int64", set(big)=={face << 70 for face in range(1, 7)})
+   wide=dice.resolveMany("1d6*2^62", 1000).tolist()
+   report("resolveMany() doesn't wrap near the int64 limit", min(wide) >= 1 << 62)
+   histogram=dice.getHistogram("1d6*2^62", 10000)
+   mean=float(histogram.split("Mean: ")[1].split()[0])
+   report("getHistogram() mean of '1d6*2^62' is positive", abs(mean/2**62-3.5) < 0.1)
+
+   # Seeded and parallel histograms roll with the caller's limits
+   limited=DiceResolver()
+   limited.maxDraws=10**6
+   try:
+      limited.getHistogram("200000d2", 2, seed=1)
+      report("Seeded histogram uses the caller's maxDraws", True)
+   except DiceLimitError:
+      report("Seeded histogram uses the caller's maxDraws", False)
+   limited.maxExplosions=0
+   histogram=limited.getHistogram("1d2x", 1000, seed=1)
+   report("Seeded histogram uses the caller's maxExplosions", "[  3]" not in histogram)
+
+   report("Histogram.add_trials() is addTrials()", dice.histogram("1d6").add_trials(100).total==100)
+
+   # Literals too long for maxBits are refused before int() parses them
+   value=dice.resolve("9"*5000)
+   refused=value==0 and dice.error and isinstance(dice.lastError, DiceLimitError)
+   report("An over-long literal raises DiceLimitError", refused and dice.resolveBatch(["9"*5000, "2"])==[0, 2])
+
+   return (failures)
+
+# Compares the per-evaluation cost of the token interpreter
+# (evaluateRPN(), which copies the queue and re-parses every token)
+# with the compiled closure program (evaluate()).
+def benchmark(rounds=100000):
+   expressions=["(12+2^3)/10*8%5", "3d6", "2d4 + 3d6 - 1", "10d20+3d6-2", "5C2 + 4! - 1d6"]
+   dice=DiceResolver()
+   timer=Timer()
+
+   print(f"{'Expression':20} {'Interpreted':>14} {'Compiled':>14} {'Speedup':>8}")
+   for expression in expressions:
+      dice.infixToRPN(expression)
+      timer.start()
+      for i in range(rounds):
+         dice.evaluateRPN()
+      interpreted=timer.elapsed("µs")/rounds
+
+      compiled=dice.compile(expression)
+      timer.start()
+      for i in range(rounds):
+         dice.evaluate(compiled)
+      fast=timer.elapsed("µs")/rounds
+
+      print(f"{expression:20} {interpreted:11.2f} µs {fast:11.2f} µs {interpreted/fast:7.1f}x")
+
+# Interactive testing; use 'python dice.py bench' for the benchmark,
+# and 'python dice.py check' for the engine checks
 if __name__ == "__main__":
-   test()
+   if (len(sys.argv) > 1 and sys.argv[1]=="bench"):
+      benchmark()
+   elif (len(sys.argv) > 1 and sys.argv[1]=="check"):
+      sys.exit(1 if check() else 0)
+   else:
+      test()
 
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+
+# DiceServer
+# An asyncio TCP front end for DiceResolver, so a chat bot (or anything
+# else) can roll dice without wrapping the resolver in its own thread.
+# Typical use: python diceserver.py [port]
+#              python diceserver.py bench [host port]
+
+# Protocol: newline delimited UTF-8 text.  Each line is one expression,
+# and gets exactly one line back, in order:
+#    "3d6+2"      -->  "14"
+#    "(9*7"       -->  "ERR Unmatched '(' at position 0"
+# Requests may be pipelined: a client can send many lines without
+# waiting, and read the replies as they come.  A line longer than
+# 'maxLine' bytes gets an error reply, and the connection is closed.
+
+import sys
+import asyncio
+from time import perf_counter
+from dice import DiceResolver, ExpressionCache
+from timer import Timer
+
+# Serves DiceResolver over TCP.  Every connection gets its own resolver
+# (so 'error' and the random stream aren't shared between clients), but
+# all of them share one compiled-expression cache, so an expression is
+# only compiled once, whichever client sends it.
+class DiceServer:
+   def __init__(self, host="127.0.0.1", port=7777, cache=None):
+      self.host=host
+      self.port=port
+      self.cache = cache if cache is not None else ExpressionCache()
+
+      # Longest request line accepted, in bytes
+      self.maxLine=1024
+
+      # Counters, for monitoring
+      self.connections=0
+      self.requests=0
+      self.errors=0
+
+      self.__server=None
+
+   # Starts listening, and returns the asyncio.Server.  With port 0 the
+   # OS picks a free port; 'port' is updated to the one bound.
+   async def start(self):
+      self.__server=await asyncio.start_server(self.__handle, self.host, self.port, limit=self.maxLine+1)
+      self.port=self.__server.sockets[0].getsockname()[1]
+      return (self.__server)
+
+   # Stops listening and waits for the server to close
+   async def stop(self):
+      if (self.__server is not None):
+         self.__server.close()
+         await self.__server.wait_closed()
+         self.__server=None
+
+   # Starts (if need be) and serves until cancelled
+   async def serve(self):
+      if (self.__server is None):
+         await self.start()
+      async with self.__server:
+         await self.__server.serve_forever()
+
+   # Blocking convenience wrapper around serve()
+   def run(self):
+      try:
+         asyncio.run(self.serve())
+      except KeyboardInterrupt:
+         pass
+
+   # Resolves one request line into its reply line (as bytes)
+   def respond(self, dice, line):
+      self.requests+=1
+      try:
+         dice.lastError=None
+         value=dice.resolve(line.decode("utf-8").strip())
+         if (not dice.error):
+            return (f"{value}\n".encode())
+         reason=str(dice.lastError) if dice.lastError is not None else "Invalid expression"
+      except UnicodeDecodeError:
+         reason="Request is not UTF-8"
+      self.errors+=1
+      return (f"ERR {reason}\n".encode())
+
+   # One connection.  Replies are written as soon as each line is
+   # resolved; drain() only blocks once the socket's write buffer is
+   # full, so a pipelining client is never held to one request per
+   # round trip.
+   async def __handle(self, reader, writer):
+      self.connections+=1
+      dice=DiceResolver(cache=self.cache)
+      try:
+         while (True):
+            try:
+               line=await reader.readline()
+            except (asyncio.LimitOverrunError, ValueError):
+               self.errors+=1
+               writer.write(f"ERR Request longer than {self.maxLine} bytes\n".encode())
+               break
+            if (not line):
+               break
+            writer.write(self.respond(dice, line))
+            await writer.drain()
+         await writer.drain()
+      except ConnectionError:
+         pass
+      finally:
+         writer.close()
+         try:
+            await writer.wait_closed()
+         except ConnectionError:
+            pass
+
+# Client half of the load test: sends 'requests' expressions over one
+# connection, keeping up to 'pipeline' of them in flight, and appends
+# the latency (in seconds) of each one to 'latencies'.
+async def _loadClient(host, port, expressions, requests, pipeline, latencies):
+   reader, writer = await asyncio.open_connection(host, port)
+   sent=[]
+   received=0
+   try:
+      while (received < requests):
+         # Top up the pipeline, then wait for the oldest reply
+         while (len(sent)-received < pipeline and len(sent) < requests):
+            writer.write((expressions[len(sent) % len(expressions)]+"\n").encode())
+            sent.append(perf_counter())
+         await writer.drain()
+         await reader.readline()
+         latencies.append(perf_counter()-sent[received])
+         received+=1
+   finally:
+      writer.close()
+      await writer.wait_closed()
+
+# Value at quantile q of sorted data (nearest rank)
+def _quantile(data, q):
+   return (data[min(len(data)-1, int(q*len(data)))])
+
+# Runs 'connections' clients against a server, and returns a dictionary
+# with requests per second and p50/p99 latency (in milliseconds).
+async def loadTest(host, port, expressions, connections=8, requests=10000, pipeline=16):
+   latencies=[]
+   perClient=max(1, requests // connections)
+   timer=Timer()
+   timer.start()
+   await asyncio.gather(*[_loadClient(host, port, expressions, perClient, pipeline, latencies)
+                          for i in range(connections)])
+   elapsed=timer.elapsed("s")
+   latencies.sort()
+   return ({"requests": len(latencies), "seconds": elapsed,
+            "rate": len(latencies)/elapsed,
+            "p50": _quantile(latencies, 0.50)*1000,
+            "p99": _quantile(latencies, 0.99)*1000})
+
+# Load benchmark against localhost.  Without a host, a server is started
+# in this process (so client and server share one core; run the server
+# separately for numbers closer to production).
+async def benchmark(host=None, port=None, requests=20000):
+   expressions=["1d20+5", "2d6+3", "4d6kh3", "(12+2^3)/10*8%5", "10d20+3d6-2", "3d6x"]
+
+   server=None
+   if (host is None):
+      server=DiceServer(port=0)
+      await server.start()
+      host, port = server.host, server.port
+
+   print(f"Load test against {host}:{port}, {requests:,} requests per run")
+   print(f"{'Connections':>11} {'Pipeline':>8} {'Req/s':>10} {'p50':>10} {'p99':>10}")
+   try:
+      for connections, pipeline in [(1, 1), (1, 16), (8, 1), (8, 16), (32, 32)]:
+         result=await loadTest(host, port, expressions, connections, requests, pipeline)
+         print(f"{connections:11} {pipeline:8} {result['rate']:10,.0f} {result['p50']:7.3f} ms {result['p99']:7.3f} ms")
+   finally:
+      if (server is not None):
+         print(f"Cache: {server.cache.stats()}")
+         await server.stop()
+
+# Runs the server; use 'python diceserver.py bench' for the benchmark
+if __name__ == "__main__":
+   if (len(sys.argv) > 1 and sys.argv[1]=="bench"):
+      if (len(sys.argv) > 3):
+         asyncio.run(benchmark(sys.argv[2], int(sys.argv[3])))
+      else:
+         asyncio.run(benchmark())
+   else:
+      port=int(sys.argv[1]) if len(sys.argv) > 1 else 7777
+      server=DiceServer(port=port)
+      print(f"Rolling dice on {server.host}:{port}")
+      server.run()